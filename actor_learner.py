@@ -0,0 +1,161 @@
+"""
+Parallel training: actor processes play headless games and a learner process trains the model
+"""
+
+import argparse
+import queue
+import random
+import time
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+import agent
+from agent import Agent
+from gameAI import GameAI
+from features import STATE_DTYPES
+from main import state_extractor
+from model import Linear_QNet
+import logger_helper
+
+# --------------------------------------------------------
+# If not set, follow the default debug configuration
+DEBUG = None
+LOG_FILENAME = None
+DEBUG_FILENAME = None
+
+# Number of actor processes playing games
+ACTORS = 4
+# The learner sends its weights to the actors every BROADCAST_EVERY games
+BROADCAST_EVERY = 10
+# Long memory updates the learner makes for every game it receives
+UPDATES_PER_GAME = 1
+# Seconds the learner waits for a game before checking that the actors are still alive
+QUEUE_TIMEOUT = 1
+
+# --------------------------------------------------------
+
+# Set up logging
+logger = logger_helper.setup_logger(__name__, LOG_FILENAME, DEBUG, DEBUG_FILENAME)
+
+
+def run_actor(actor_id: int, shared_model: Linear_QNet, weights_version, weights_lock, games_played, stop,
+              games_queue, seed: int):
+    # Play games with the latest weights broadcast by the learner and send every finished game to the learner. The
+    # actor logs to its own files, the ones of the learner belong to its process
+    logger_helper.setup_worker_logging(f"actor{actor_id}")
+    torch.set_num_threads(1)
+    random.seed(seed)
+    torch.manual_seed(seed)
+    game_agent = Agent(learner=False)
+    game = GameAI(headless=True)
+    extract_state = state_extractor()
+    state_dtype = STATE_DTYPES[agent.FEATURES]
+    version = -1
+    states, actions, rewards, next_states, game_overs = [], [], [], [], []
+    while not stop.is_set():
+        state_old = extract_state(game)
+        action = game_agent.get_action(state_old)
+        reward, score, game_over = game.next_tick(action)
+        state_new = extract_state(game)
+        states.append(state_old)
+        actions.append(action.value.index(1))
+        rewards.append(reward)
+        next_states.append(state_new)
+        game_overs.append(game_over)
+
+        if game_over:
+            game.reset()
+            games_queue.put((actor_id, score, np.array(states, dtype=state_dtype), np.array(actions, dtype=np.int8),
+                             np.array(rewards, dtype=np.float32), np.array(next_states, dtype=state_dtype),
+                             np.array(game_overs, dtype=bool)))
+            states, actions, rewards, next_states, game_overs = [], [], [], [], []
+            # The exploration schedule follows the number of games played by all the actors
+            game_agent.n_games = games_played.value
+            if weights_version.value != version:
+                with weights_lock:
+                    version = weights_version.value
+                    game_agent.model.load_state_dict(shared_model.state_dict())
+                game_agent.invalidate_table()
+
+
+def train_parallel(n_actors: int = ACTORS, max_games: int | None = None, duration: float | None = None,
+                   save_model: bool = True, seed: int = 0) -> dict:
+    # Run n_actors actors and train on their games in this process until max_games games (agent.MAX_GAMES by
+    # default) have been played or duration seconds have passed. Returns the scores and the throughput of the run
+    if max_games is None:
+        max_games = agent.MAX_GAMES
+    game_agent = Agent()
+    # Weights shared with the actors, only written by the learner while holding weights_lock
+    shared_model = Linear_QNet(agent.INPUT_SIZE, agent.HIDDEN_LAYER_SIZE, agent.OUTPUT_SIZE)
+    shared_model.load_state_dict(game_agent.model.state_dict())
+    shared_model.share_memory()
+    weights_version = mp.Value("i", 0)
+    weights_lock = mp.Lock()
+    games_played = mp.Value("i", 0)
+    stop = mp.Event()
+    games_queue = mp.Queue()
+    actors = [mp.Process(target=run_actor, args=(i, shared_model, weights_version, weights_lock, games_played, stop,
+                                                 games_queue, seed + i), daemon=True)
+              for i in range(n_actors)]
+    for actor in actors:
+        actor.start()
+
+    scores = []
+    record = 0
+    transitions = 0
+    start = time.perf_counter()
+    while game_agent.n_games < max_games and (duration is None or time.perf_counter() - start < duration):
+        try:
+            actor_id, score, *game = games_queue.get(timeout=QUEUE_TIMEOUT)
+        except queue.Empty:
+            if not any(actor.is_alive() for actor in actors):
+                logger.error("Every actor stopped, ending the training.")
+                break
+            continue
+        game_agent.memory.push_many(*game)
+        transitions += len(game[1])
+        game_agent.n_games += 1
+        games_played.value = game_agent.n_games
+        for _ in range(UPDATES_PER_GAME):
+            game_agent.train_long_memory()
+        if game_agent.n_games % BROADCAST_EVERY == 0:
+            with weights_lock:
+                shared_model.load_state_dict(game_agent.model.state_dict())
+                weights_version.value += 1
+
+        scores.append(score)
+        if score > record:
+            record = score
+            if save_model:
+                game_agent.model.save()
+        log_message = f"Game number: {game_agent.n_games}\t\tActor: {actor_id}\tScore: {score}\t" \
+                      f"Current record: {record}."
+        print(log_message)
+        logger.info(log_message)
+    seconds = time.perf_counter() - start
+
+    # The actors can't exit while the games they already sent are waiting in the queue
+    stop.set()
+    while any(actor.is_alive() for actor in actors):
+        try:
+            while True:
+                games_queue.get_nowait()
+        except queue.Empty:
+            pass
+        for actor in actors:
+            actor.join(timeout=0.1)
+    return {
+        "scores": scores,
+        "seconds": seconds,
+        "transitions_per_second": transitions / seconds,
+        "games_per_hour": len(scores) / seconds * 3600,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the snake agent with parallel actors.")
+    parser.add_argument("--actors", type=int, default=ACTORS, help="number of actor processes")
+    parser.add_argument("--games", type=int, default=agent.MAX_GAMES, help="number of games to train on")
+    args = parser.parse_args()
+    result = train_parallel(args.actors, max_games=args.games)
+    print(f"{result['transitions_per_second']:,.0f} transitions/sec, {result['games_per_hour']:,.0f} games/hour.")
@@ -1,7 +1,11 @@
+import copy
+import numpy as np
 import torch
 import random
-from collections import deque
+from encoding import ALL_STATES
+from features import FEATURE_SIZES
 from gameAI import Action
+from memory import ReplayMemory, PrioritizedReplayMemory, unpack
 from model import Linear_QNet, QTrainer
 import logger_helper
 
@@ -11,12 +15,39 @@ DEBUG = None
 LOG_FILENAME = None
 DEBUG_FILENAME = None
 
-INPUT_SIZE = 11
+# State features given to the model (see features.py): "binary" (11 binary features, packed in the replay memory) or
+# "rich" (binary features plus obstacle distances, reachable areas and tail distance, stored as float vectors)
+FEATURES = "binary"
+INPUT_SIZE = FEATURE_SIZES[FEATURES]
 OUTPUT_SIZE = 3
 HIDDEN_LAYER_SIZE = 256
 
+# Number of transitions kept in the replay memory (10 bytes each with the binary features)
 MAX_MEMORY = 100_000
 BATCH_SIZE = 1_000
+# Training schedule (see Agent.train_on_step):
+# train on every step as it happens, with a batch of one
+TRAIN_SHORT_MEMORY = True
+# every TRAIN_EVERY steps (0 = never) make GRADIENT_STEPS updates on mini-batches of MINIBATCH_SIZE transitions sampled
+# from the memory
+TRAIN_EVERY = 0
+GRADIENT_STEPS = 1
+MINIBATCH_SIZE = 64
+# train on BATCH_SIZE transitions at the end of every game
+TRAIN_LONG_MEMORY = True
+# don't train at all until the memory holds WARMUP_STEPS transitions
+WARMUP_STEPS = 0
+# Prioritized experience replay: sample transitions proportionally to their TD error instead of uniformly
+PRIORITIZED_REPLAY = False
+# How much prioritization is used (0 = uniform sampling)
+PRIORITY_ALPHA = 0.6
+# Importance sampling correction at the start of training, increased by PRIORITY_BETA_INCREMENT every sampled batch
+# (every long memory training and every mini-batch update) until it reaches 1. With TRAIN_EVERY > 0 batches are sampled
+# many times per game, lower the increment accordingly
+PRIORITY_BETA = 0.4
+PRIORITY_BETA_INCREMENT = 0.001
+# Added to the TD error so that every transition can still be sampled
+PRIORITY_EPSILON = 0.01
 MAX_GAMES = 1_000
 # Percentage of MAX_GAMES in which we allow exploring
 EXPLORING_PERCENTAGE = 0.07
@@ -28,6 +59,17 @@ INITIAL_EXPLORING_PROBABILITY = 0.6
 LR = 0.001
 # Discount rate (must be in (0,1), usually around 0.8-0.9)
 GAMMA = 0.9
+# Network computing the bootstrap targets: "none" (the trained model itself), "hard" (frozen copy of the model, synced
+# every TARGET_SYNC_EVERY training updates) or "polyak" (moved towards the model by TARGET_TAU after every update)
+TARGET_NETWORK = "none"
+TARGET_SYNC_EVERY = 100
+TARGET_TAU = 0.005
+# Double DQN targets: the next action is chosen by the trained model and valued by the target network
+DOUBLE_DQN = False
+# Choose the greedy actions from a table with the best action of each of the 2^INPUT_SIZE states, instead of running the
+# model at every step (binary features only). The table is rebuilt every LOOKUP_REFRESH_EVERY training updates
+LOOKUP_POLICY = False
+LOOKUP_REFRESH_EVERY = 100
 # Game speed
 SPEED_INITIAL = 200
 SPEED_FINAL = 100
@@ -37,67 +79,194 @@ SPEED_FINAL = 100
 # Set up logging
 logger = logger_helper.setup_logger(__name__, LOG_FILENAME, DEBUG, DEBUG_FILENAME)
 
+# Actions in the order of the model outputs
+ACTIONS = list(Action)
+
+
+def model_input(states) -> torch.Tensor:
+    # Packed binary states are unpacked with a single lookup, rich states are already float vectors
+    if FEATURES == "binary":
+        return unpack(states)
+    return torch.as_tensor(states)
+
+
+def greedy_table(model: Linear_QNet) -> np.ndarray:
+    # Index of the best action for every packed state
+    with torch.no_grad():
+        prediction = model(torch.from_numpy(ALL_STATES).float())
+    return torch.argmax(prediction, dim=1).numpy()
+
 
 class Agent:
-    def __init__(self):
+    def __init__(self, learner: bool = True, seed: int | None = None):
+        # An agent that is not a learner only plays (e.g. an actor process), it has no memory and no trainer
+        if LOOKUP_POLICY and FEATURES != "binary":
+            raise ValueError(f"The lookup policy needs the binary features, not the {FEATURES} ones.")
         self.n_games = 0
+        # Steps played, for the training schedule
+        self.steps = 0
         # Parameter controlling the chance to explore
         self.epsilon = 0
         # Discount rate
         self.gamma = GAMMA
-        # Memory
-        self.memory = deque(maxlen=MAX_MEMORY)
-        # Model and trainer
+        # Random generator of the batched exploration
+        self.rng = np.random.default_rng(seed)
+        # Model
         self.model = Linear_QNet(INPUT_SIZE, HIDDEN_LAYER_SIZE, OUTPUT_SIZE)
-        self.trainer = QTrainer(self.model, lr=LR, gamma=self.gamma)
+        # Greedy action table of the lookup policy
+        self.table = None
+        self.table_updates = 0
+        if not learner:
+            self.memory = None
+            self.trainer = None
+            return
+        # Memory
+        state_size = None if FEATURES == "binary" else INPUT_SIZE
+        if PRIORITIZED_REPLAY:
+            self.memory = PrioritizedReplayMemory(MAX_MEMORY, PRIORITY_ALPHA, PRIORITY_BETA, PRIORITY_BETA_INCREMENT,
+                                                  PRIORITY_EPSILON, seed, state_size)
+        else:
+            self.memory = ReplayMemory(MAX_MEMORY, seed, state_size)
+        # Trainer
+        self.trainer = QTrainer(self.model, lr=LR, gamma=self.gamma, target_network=TARGET_NETWORK,
+                                sync_every=TARGET_SYNC_EVERY, tau=TARGET_TAU, double=DOUBLE_DQN)
+
+    # Greedy action table, rebuilt when missing (call invalidate_table after loading new weights) or when the trainer
+    # made LOOKUP_REFRESH_EVERY updates since it was built
+    def policy_table(self) -> np.ndarray:
+        n_updates = self.trainer.n_updates if self.trainer is not None else 0
+        if self.table is None or n_updates - self.table_updates >= LOOKUP_REFRESH_EVERY:
+            self.table = greedy_table(self.model)
+            self.table_updates = n_updates
+        return self.table
+
+    def invalidate_table(self):
+        self.table = None
+
+    # Everything needed to resume the training of the agent, copied so that it can be written in the background
+    def state_dict(self) -> dict:
+        return {
+            "n_games": self.n_games,
+            "steps": self.steps,
+            "epsilon": self.epsilon,
+            "rng": self.rng.bit_generator.state,
+            "model": {k: v.clone() for k, v in self.model.state_dict().items()},
+            "optimizer": copy.deepcopy(self.trainer.optimizer.state_dict()),
+            "n_updates": self.trainer.n_updates,
+            "target_model": {k: v.clone() for k, v in self.trainer.target_model.state_dict().items()},
+            "memory": self.memory.state_dict(),
+        }
+
+    def load_state_dict(self, state: dict):
+        self.n_games = state["n_games"]
+        self.steps = state.get("steps", 0)
+        self.epsilon = state["epsilon"]
+        self.rng.bit_generator.state = state["rng"]
+        self.model.load_state_dict(state["model"])
+        self.trainer.optimizer.load_state_dict(state["optimizer"])
+        self.trainer.n_updates = state["n_updates"]
+        self.trainer.target_model.load_state_dict(state.get("target_model", state["model"]))
+        self.memory.load_state_dict(state["memory"])
+        self.invalidate_table()
 
+    # States are packed integers (see main.get_state) or float vectors with the rich features
     def remember(self, state, action_value, reward, next_state, game_over):
-        # Add to memory the latest info, if the memory exceeds MAX_MEMORY we forget the oldest info memorized
-        self.memory.append((state, action_value, reward, next_state, game_over))
-
-    # Train with a big batch (at most BATCH_SIZE) data points
-    def train_long_memory(self):
-        # if we have more than the required BATCH_SIZE, we randomly select a sample from memory
-        if len(self.memory) > BATCH_SIZE:
-            batch = random.sample(self.memory, BATCH_SIZE)
-        # otherwise we take everything we have
+        # Add to memory the latest info, if the memory exceeds MAX_MEMORY we forget the oldest info memorized.
+        # The action is stored as its index in the order STRAIGHT -> RIGHT -> LEFT
+        self.memory.push(state, action_value.index(1), reward, next_state, game_over)
+
+    # Train with a big batch (at most BATCH_SIZE) data points, returns the loss
+    def train_long_memory(self) -> float:
+        return self.train_memory(BATCH_SIZE)
+
+    # Train with a batch of at most batch_size data points sampled from the memory, returns the loss
+    def train_memory(self, batch_size: int) -> float:
+        # if we have more than the required batch_size, we randomly select a sample from memory,
+        # otherwise we take everything we have. The sample is already made of tensors for the trainer
+        if isinstance(self.memory, PrioritizedReplayMemory):
+            states, actions, rewards, next_states, game_overs, indexes, weights = self.memory.sample(batch_size)
+            loss, td_error = self.trainer.train_step(states, actions, rewards, next_states, game_overs, weights)
+            self.memory.update_priorities(indexes, td_error.numpy())
         else:
-            batch = self.memory
-        # We create tuples of every state, action, reward etc..
-        # for example given batch = [(0,1,2),(3,4,5),(6,7,8)] zip(*batch) would return [(6,3,0), (7,4,1), (8,5,2)]
-        states, actions, rewards, next_states, game_overs = zip(*batch)
-        self.trainer.train_step(states, actions, rewards, next_states, game_overs)
+            states, actions, rewards, next_states, game_overs = self.memory.sample(batch_size)
+            loss, td_error = self.trainer.train_step(states, actions, rewards, next_states, game_overs)
+        return loss
+
+    # The memory holds enough transitions to start training
+    def warmed_up(self) -> bool:
+        return len(self.memory) >= WARMUP_STEPS
+
+    # Training after every step, following the training schedule. Returns the sum of the losses of the updates made
+    def train_on_step(self, state, action_value, reward, next_state, game_over) -> float:
+        self.steps += 1
+        if not self.warmed_up():
+            return 0.0
+        loss = 0.0
+        if TRAIN_SHORT_MEMORY:
+            loss += self.train_short_memory(state, action_value, reward, next_state, game_over)
+        if TRAIN_EVERY > 0 and self.steps % TRAIN_EVERY == 0:
+            for _ in range(GRADIENT_STEPS):
+                loss += self.train_memory(MINIBATCH_SIZE)
+        return loss
 
     # Train with the last data point created
-    def train_short_memory(self, state, action_value, reward, next_state, game_over):
-        self.trainer.train_step(state, action_value, reward, next_state, game_over)
+    def train_short_memory(self, state, action_value, reward, next_state, game_over) -> float:
+        loss, td_error = self.trainer.train_step(model_input(state), action_value.index(1), reward,
+                                                 model_input(next_state), game_over)
+        return loss
 
-    # Produce an action from the model
-    def get_action(self, state) -> Action:
-        action_value = [0, 0, 0]
+    # Update epsilon for the current game and return the upper limit of the exploration draw
+    def update_epsilon(self) -> int:
         # We need to balance exploration / exploitation
         # During the first iterations we favor taking random actions and exploring the environment,
         # with the probability of doing so linearly decreasing to zero until iteration MAX_GAMES*EXPLORING_PERCENTAGE
         self.epsilon = MAX_EXPLORATION - self.n_games
-        upper_limit = int(MAX_EXPLORATION / (1 - INITIAL_EXPLORING_PROBABILITY))
+        return int(MAX_EXPLORATION / (1 - INITIAL_EXPLORING_PROBABILITY))
+
+    # Probability of a random action in the current game, as drawn by get_action
+    def exploration_probability(self) -> float:
+        upper_limit = self.update_epsilon()
+        return max(self.epsilon, 0) / (upper_limit + 1)
+
+    # Produce an action from the model
+    def get_action(self, state) -> Action:
+        upper_limit = self.update_epsilon()
         if random.randint(0, upper_limit) < self.epsilon:
             # Pick one of the options at random
             option = random.randint(0, 2)
             debug_message = "Picking random option "
+        # We look up the move the model would make
+        elif LOOKUP_POLICY:
+            option = self.policy_table()[state]
+            debug_message = "Picking tabulated option "
         # We let the model decide the next move
         else:
             # The output is a tensor with three elements, to convert it into a valid action we execute the option
             # with maximum value (if there's a tie we always take the first one in the order STRAIGHT -> RIGHT -> LEFT)
-            state_tensor = torch.tensor(state, dtype=torch.float)
-            prediction = self.model(state_tensor)
+            with torch.no_grad():
+                prediction = self.model(model_input(state))
             option = torch.argmax(prediction).item()
             debug_message = "Picking predicted option "
 
-        action_value[option] = 1
-        action_value = tuple(action_value)
+        action = ACTIONS[option]
+        if logger_helper.tracing(logger):
+            logger.debug(f"{debug_message}{action}.")
+        return action
 
-        for action in Action:
-            if action.value == action_value:
-                debug_message += f"{action}."
-                logger.debug(debug_message)
-                return action
+    # Produce the action indexes (in the order STRAIGHT -> RIGHT -> LEFT) for N games at once, states is an array of
+    # N states
+    def get_actions(self, states) -> np.ndarray:
+        states = np.asarray(states)
+        # A single table lookup or forward pass for the whole batch
+        if LOOKUP_POLICY:
+            options = self.policy_table()[states]
+        else:
+            with torch.no_grad():
+                prediction = self.model(model_input(states))
+            options = torch.argmax(prediction, dim=1).numpy()
+        # Same exploration schedule as get_action, drawn independently for every game
+        upper_limit = self.update_epsilon()
+        if self.epsilon > 0:
+            explore = self.rng.integers(0, upper_limit + 1, len(options)) < self.epsilon
+            options[explore] = self.rng.integers(0, len(ACTIONS), np.count_nonzero(explore))
+        return options
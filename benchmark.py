@@ -0,0 +1,546 @@
+"""
+Benchmarks of the environment, inference and training hot paths
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import torch
+import actor_learner
+import agent
+import export
+import main
+from agent import Agent, ACTIONS
+from encoding import N_STATES
+from features import FEATURE_SIZES
+from gameAI import GameAI, Snake, Direction
+from memory import ReplayMemory, PrioritizedReplayMemory
+from model import Linear_QNet, QTrainer
+
+# --------------------------------------------------------
+# Number of timed repetitions of every measurement
+REPEATS = 50
+# Batch sizes used to time QTrainer.train_step
+TRAIN_STEP_BATCH_SIZES = (1, 1_000, 10_000)
+# Number of transitions in the replay memories used to time sampling
+REPLAY_SIZE = 2 ** 20
+# Mean score over the last main.TARGET_WINDOW games that the training comparisons try to reach
+TARGET_SCORE = 10
+# Give up on reaching TARGET_SCORE after this many games
+TARGET_MAX_GAMES = 1_000
+# Training schedules (constants of agent.py) compared by the time to target benchmark
+TRAINING_SCHEDULES = {
+    "per_step": {"TRAIN_SHORT_MEMORY": True, "TRAIN_EVERY": 0, "WARMUP_STEPS": 0},
+    "every_4_steps": {"TRAIN_SHORT_MEMORY": False, "TRAIN_EVERY": 4, "GRADIENT_STEPS": 1, "MINIBATCH_SIZE": 64,
+                      "WARMUP_STEPS": 1_000},
+    "every_16_steps_4_updates": {"TRAIN_SHORT_MEMORY": False, "TRAIN_EVERY": 16, "GRADIENT_STEPS": 4,
+                                 "MINIBATCH_SIZE": 64, "WARMUP_STEPS": 1_000},
+    "every_64_steps_large_batch": {"TRAIN_SHORT_MEMORY": False, "TRAIN_EVERY": 64, "GRADIENT_STEPS": 1,
+                                   "MINIBATCH_SIZE": 1_024, "WARMUP_STEPS": 1_000},
+}
+# Bootstrap target settings compared by the target network benchmark, each one trained with every seed of TARGET_SEEDS
+TARGET_NETWORK_VARIANTS = {
+    "online": {"TARGET_NETWORK": "none", "DOUBLE_DQN": False},
+    "hard_sync_100": {"TARGET_NETWORK": "hard", "TARGET_SYNC_EVERY": 100, "DOUBLE_DQN": False},
+    "polyak_0.005": {"TARGET_NETWORK": "polyak", "TARGET_TAU": 0.005, "DOUBLE_DQN": False},
+    "double_dqn_hard_sync_100": {"TARGET_NETWORK": "hard", "TARGET_SYNC_EVERY": 100, "DOUBLE_DQN": True},
+}
+TARGET_SEEDS = (0, 1, 2)
+# Numbers of actor processes compared by the parallel training benchmark
+ACTOR_COUNTS = (1, 2, 4, 8)
+# Seconds of parallel training for every number of actors
+ACTOR_SECONDS = 60
+# Numbers of concurrent games compared by the action selection benchmark
+ACTION_BATCH_SIZES = (1, 64, 1_024)
+# Number of game steps timed by the environment benchmark
+NEXT_TICK_STEPS = 10_000
+# Snake lengths compared by the state extraction benchmark
+SNAKE_LENGTHS = (3, 50, 200, 600)
+# Square board sizes in cells compared by the board size benchmark
+BOARD_SIZES = (10, 20, 50, 100, 200)
+# Batch size of the batched latency of the exported models
+EXPORT_BATCH_SIZE = 1_024
+# Python code loading every exported model in a new process, timed by the startup benchmark
+EXPORT_STARTUP_CODE = {
+    "eager": "import torch; from model import Linear_QNet; "
+             "Linear_QNet({input_size}, {hidden_size}, {output_size}).load_state_dict(torch.load({eager!r}))",
+    "torchscript": "import torch; torch.jit.load({torchscript!r})",
+    "quantized": "import torch; torch.jit.load({quantized!r})",
+    "numpy": "import numpy_policy; numpy_policy.load({numpy!r})",
+}
+# Timed repetitions of the measurements starting a new process (import time, exported model startup)
+IMPORT_REPEATS = 5
+# Python code of every entry point timed by the import time benchmark, each one in a new process
+IMPORT_ENTRY_POINTS = {
+    "interpreter": "pass",
+    "headless_training": "import main",
+    "evaluation": "import evaluate",
+    "numpy_policy": "import numpy_policy",
+    "replay": "import trajectory",
+    "rendering": "import gameAI; gameAI.load_pygame()",
+}
+# Games played by the end to end training benchmark, with a fixed seed
+TRAIN_GAMES = 100
+SEED = 0
+# Agent settings of the smoke check (--smoke, not a benchmark): a few headless training games with every optional
+# training path, exiting with an error if one of them fails
+SMOKE_SETTINGS = {
+    "prioritized_replay": {"PRIORITIZED_REPLAY": True},
+    "prioritized_replay_minibatch": {"PRIORITIZED_REPLAY": True, "TRAIN_SHORT_MEMORY": False, "TRAIN_EVERY": 4,
+                                     "WARMUP_STEPS": 100},
+}
+SMOKE_GAMES = 5
+# Relative change from the baseline above which a result is reported as a regression
+REGRESSION_TOLERANCE = 0.1
+
+# --------------------------------------------------------
+
+
+def timeit(function, repeats: int = REPEATS) -> float:
+    # Median wall time of a call in seconds, after a warm up call
+    function()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return times[len(times) // 2]
+
+
+def random_transitions(batch_size: int) -> tuple:
+    # Random binary states and actions in the format stored by Agent.memory
+    state = torch.randint(0, 2, (batch_size, agent.INPUT_SIZE)).float()
+    action = torch.randint(0, agent.OUTPUT_SIZE, (batch_size,))
+    reward = torch.randint(-1, 2, (batch_size,)).float() * 10
+    next_state = torch.randint(0, 2, (batch_size, agent.INPUT_SIZE)).float()
+    game_over = reward < 0
+    return state, action, reward, next_state, game_over
+
+
+def bench_train_step(batch_sizes=TRAIN_STEP_BATCH_SIZES, repeats: int = REPEATS) -> dict:
+    # Latency of a single QTrainer.train_step update for every batch size
+    torch.manual_seed(0)
+    model = Linear_QNet(agent.INPUT_SIZE, agent.HIDDEN_LAYER_SIZE, agent.OUTPUT_SIZE)
+    trainer = QTrainer(model, lr=agent.LR, gamma=agent.GAMMA)
+    results = {}
+    for batch_size in batch_sizes:
+        transitions = random_transitions(batch_size)
+        results[f"train_step_batch_{batch_size}_seconds"] = timeit(lambda: trainer.train_step(*transitions), repeats)
+    return results
+
+
+def game_states(n_states: int, seed: int = SEED) -> list:
+    # States of n_states steps of headless games with random actions, extracted as in train() with the configured
+    # feature set (agent.FEATURES)
+    extract_state = main.state_extractor()
+    rng = np.random.default_rng(seed)
+    game = GameAI(headless=True, seed=seed)
+    states = []
+    for i in rng.integers(0, len(ACTIONS), n_states):
+        if game.next_tick(ACTIONS[i], 0)[2]:
+            game.reset()
+        states.append(extract_state(game))
+    return states
+
+
+def fill_memory(memory: ReplayMemory, states: list | None = None) -> ReplayMemory:
+    # Fill every slot with random transitions at once instead of pushing them one at a time. The states are drawn from
+    # states, or are random packed binary states if not given
+    rng = np.random.default_rng(0)
+    if states is None:
+        memory.states[:] = rng.integers(0, N_STATES, memory.capacity)
+        memory.next_states[:] = rng.integers(0, N_STATES, memory.capacity)
+    else:
+        states = np.asarray(states)
+        memory.states[:] = states[rng.integers(0, len(states), memory.capacity)]
+        memory.next_states[:] = states[rng.integers(0, len(states), memory.capacity)]
+    memory.actions[:] = rng.integers(0, agent.OUTPUT_SIZE, memory.capacity)
+    memory.rewards[:] = rng.integers(-1, 2, memory.capacity) * 10
+    memory.game_overs[:] = memory.rewards < 0
+    memory.size = memory.capacity
+    if isinstance(memory, PrioritizedReplayMemory):
+        memory.tree.update(np.arange(memory.capacity), rng.random(memory.capacity))
+    return memory
+
+
+def bench_replay_sampling(size: int = REPLAY_SIZE, batch_size: int = agent.BATCH_SIZE, repeats: int = REPEATS) -> dict:
+    # Cost of sampling a batch from a full memory of size transitions, uniform and prioritized
+    uniform = fill_memory(ReplayMemory(size, seed=0))
+    prioritized = fill_memory(PrioritizedReplayMemory(size, agent.PRIORITY_ALPHA, agent.PRIORITY_BETA,
+                                                      agent.PRIORITY_BETA_INCREMENT, agent.PRIORITY_EPSILON, seed=0))
+    indexes = prioritized.sample(batch_size)[-2]
+    td_error = np.random.default_rng(0).normal(size=len(indexes))
+    transition = (0, 0, 0, 0, False)
+    return {
+        "replay_uniform_sample_seconds": timeit(lambda: uniform.sample(batch_size), repeats),
+        "replay_prioritized_sample_seconds": timeit(lambda: prioritized.sample(batch_size), repeats),
+        "replay_prioritized_update_seconds": timeit(lambda: prioritized.update_priorities(indexes, td_error), repeats),
+        "replay_uniform_push_seconds": timeit(lambda: uniform.push(*transition), repeats),
+        "replay_prioritized_push_seconds": timeit(lambda: prioritized.push(*transition), repeats),
+    }
+
+
+def bench_prioritized_replay(target_score: float = TARGET_SCORE, max_games: int = TARGET_MAX_GAMES) -> dict:
+    # Games and wall time needed to reach target_score with uniform and with prioritized replay
+    results = {}
+    for name, enabled in (("uniform", False), ("prioritized", True)):
+        seconds, games = train_to_target({"PRIORITIZED_REPLAY": enabled}, target_score, max_games)
+        results[f"{name}_seconds_to_target"] = seconds
+        results[f"{name}_games_to_target"] = games
+    return results
+
+
+def train_to_target(settings: dict, target_score: float | None, max_games: int, seed: int = SEED) -> (float, int):
+    # Wall time and games of a headless training with the given agent settings, until target_score or max_games
+    defaults = {setting: getattr(agent, setting) for setting in settings}
+    for setting, value in settings.items():
+        setattr(agent, setting, value)
+    try:
+        start = time.perf_counter()
+        scores = main.train(headless=True, plotting=False, max_games=max_games, target_score=target_score,
+                            save_model=False, checkpoint_every=0, metrics_filename=None, seed=seed)
+        return time.perf_counter() - start, len(scores)
+    finally:
+        for setting, value in defaults.items():
+            setattr(agent, setting, value)
+
+
+def bench_training_schedule(schedules: dict = TRAINING_SCHEDULES, target_score: float = TARGET_SCORE,
+                            max_games: int = TARGET_MAX_GAMES) -> dict:
+    # Wall time and games needed to reach target_score with every training schedule
+    results = {}
+    for name, schedule in schedules.items():
+        seconds, games = train_to_target(schedule, target_score, max_games)
+        results[f"{name}_seconds_to_target"] = seconds
+        results[f"{name}_games_to_target"] = games
+    return results
+
+
+def bench_target_network(variants: dict = TARGET_NETWORK_VARIANTS, seeds=TARGET_SEEDS,
+                         target_score: float = TARGET_SCORE, max_games: int = TARGET_MAX_GAMES) -> dict:
+    # Mean wall time and games needed to reach target_score with every kind of bootstrap target, over the same seeds.
+    # Runs stopped by max_games count as max_games games
+    results = {}
+    for name, settings in variants.items():
+        runs = [train_to_target(settings, target_score, max_games, seed) for seed in seeds]
+        results[f"{name}_seconds_to_target"] = sum(seconds for seconds, _ in runs) / len(runs)
+        results[f"{name}_games_to_target"] = sum(games for _, games in runs) / len(runs)
+    return results
+
+
+def bench_actors(actor_counts=ACTOR_COUNTS, seconds: float = ACTOR_SECONDS) -> dict:
+    # Throughput of the actor/learner training for every number of actors
+    results = {}
+    for n_actors in actor_counts:
+        result = actor_learner.train_parallel(n_actors, max_games=10 ** 9, duration=seconds, save_model=False)
+        results[f"actors_{n_actors}_transitions_per_second"] = result["transitions_per_second"]
+        results[f"actors_{n_actors}_games_per_hour"] = result["games_per_hour"]
+    return results
+
+
+def bench_action_selection(batch_sizes=ACTION_BATCH_SIZES, repeats: int = REPEATS) -> dict:
+    # Cost per game of choosing the next action of N games, one get_action call per game vs a single get_actions call
+    game_agent = Agent(learner=False)
+    # Past the exploration phase, so that every action comes from the model
+    game_agent.n_games = agent.MAX_EXPLORATION
+    results = {}
+    for batch_size in batch_sizes:
+        state_list = game_states(batch_size)
+        states = np.asarray(state_list)
+        single = timeit(lambda: [game_agent.get_action(state) for state in state_list], repeats)
+        batched = timeit(lambda: game_agent.get_actions(states), repeats)
+        results[f"get_action_{batch_size}_games_seconds_per_game"] = single / batch_size
+        results[f"get_actions_{batch_size}_games_seconds_per_game"] = batched / batch_size
+    return results
+
+
+def bench_lookup_policy(repeats: int = REPEATS) -> dict:
+    # Latency of a single greedy get_action with the model and with the lookup table
+    lookup_policy = agent.LOOKUP_POLICY
+    state = 0
+    results = {}
+    for name, enabled in (("model", False), ("table", True)):
+        agent.LOOKUP_POLICY = enabled
+        game_agent = Agent(learner=False)
+        game_agent.n_games = agent.MAX_EXPLORATION
+        results[f"get_action_{name}_seconds"] = timeit(lambda: game_agent.get_action(state), repeats * 100)
+    results["lookup_table_refresh_seconds"] = timeit(lambda: agent.greedy_table(game_agent.model), repeats)
+    agent.LOOKUP_POLICY = lookup_policy
+    return results
+
+
+def bench_export(batch_size: int = EXPORT_BATCH_SIZE, repeats: int = REPEATS) -> dict:
+    # Single state and batched latency, process startup time (imports and loading) and greedy action agreement with
+    # the eager model of every exported variant
+    model = Linear_QNet(agent.INPUT_SIZE, agent.HIDDEN_LAYER_SIZE, agent.OUTPUT_SIZE).eval()
+    states = export.parity_states(agent.FEATURES)
+    batch = states[np.random.default_rng(SEED).integers(0, len(states), batch_size)]
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        filenames = export.export(model, agent.FEATURES, folder)
+        filenames["eager"] = os.path.join(folder, "model.pth")
+        torch.save(model.state_dict(), filenames["eager"])
+        variants = {"eager": model, **export.load_variants(filenames)}
+        for name, variant in variants.items():
+            if name == "numpy":
+                forward = variant
+            else:
+                def forward(x, module=variant):
+                    with torch.no_grad():
+                        return module(torch.from_numpy(x))
+            # A single state is a batch of one, the quantized linear layers only take 2-D inputs
+            results[f"{name}_single_state_seconds"] = timeit(lambda: forward(states[:1]), repeats * 100)
+            batch_seconds = timeit(lambda: forward(batch), repeats)
+            results[f"{name}_batch_{batch_size}_seconds_per_state"] = batch_seconds / batch_size
+            results[f"{name}_action_agreement"] = export.action_agreement(model, variant, states)
+        sizes = {"input_size": agent.INPUT_SIZE, "hidden_size": agent.HIDDEN_LAYER_SIZE,
+                 "output_size": agent.OUTPUT_SIZE}
+        for name, code in EXPORT_STARTUP_CODE.items():
+            command = [sys.executable, "-c", code.format(**sizes, **filenames)]
+            cwd = os.path.dirname(os.path.abspath(__file__))
+            results[f"{name}_startup_seconds"] = timeit(lambda: subprocess.run(command, cwd=cwd, check=True),
+                                                        IMPORT_REPEATS)
+    return results
+
+
+def bench_import_time(entry_points: dict = IMPORT_ENTRY_POINTS, repeats: int = IMPORT_REPEATS) -> dict:
+    # Wall time of a new process running every entry point, and number of files it leaves in its working directory
+    # (log files created at import). The processes run in an empty folder, with this folder on their path
+    results = {}
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    for name, code in entry_points.items():
+        with tempfile.TemporaryDirectory() as folder:
+            command = [sys.executable, "-c", code]
+            results[f"{name}_import_seconds"] = timeit(
+                lambda: subprocess.run(command, cwd=folder, env=env, check=True, stdout=subprocess.DEVNULL), repeats)
+            results[f"{name}_files_created"] = len(os.listdir(folder))
+    return results
+
+
+def bench_next_tick(steps: int = NEXT_TICK_STEPS) -> dict:
+    # Game steps per second with random actions, headless and with a window (no frame rate limit). Without a display
+    # the window is emulated by the SDL dummy video driver
+    if "DISPLAY" not in os.environ and sys.platform.startswith("linux"):
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    rng = np.random.default_rng(SEED)
+    actions = [ACTIONS[i] for i in rng.integers(0, len(ACTIONS), steps)]
+    results = {}
+    for name, headless in (("headless", True), ("headful", False)):
+        game = GameAI(headless=headless)
+        start = time.perf_counter()
+        for action in actions:
+            if game.next_tick(action, 0)[2]:
+                game.reset()
+        results[f"next_tick_{name}_steps_per_second"] = steps / (time.perf_counter() - start)
+    return results
+
+
+def long_snake_game(length: int) -> GameAI:
+    # Headless game whose snake winds row by row from the top left corner until it is length sections long
+    game = GameAI(headless=True)
+    cols = game.cols - 2
+    rows = game.rows - 2
+    if length > cols * rows:
+        raise ValueError(f"A snake of length {length} doesn't fit in the board.")
+    snake = Snake(game.cols, game.rows, length=1, x=1, y=1)
+    path = [(x if y % 2 == 0 else cols - 1 - x, y) for y in range(rows) for x in range(cols)]
+    for (x0, y0), (x1, y1) in zip(path[:length - 1], path[1:length]):
+        snake.direction = next(d for d in Direction if d.value == (x1 - x0, y1 - y0))
+        snake.add_section()
+        snake.move()
+    game.snake = snake
+    game.place_food()
+    return game
+
+
+def bench_get_state(lengths=SNAKE_LENGTHS, repeats: int = REPEATS) -> dict:
+    # Cost of main.get_state for snakes of growing length
+    results = {}
+    for length in lengths:
+        game = long_snake_game(length)
+        results[f"get_state_length_{length}_seconds"] = timeit(lambda: main.get_state(game), repeats * 100)
+    return results
+
+
+def bench_features(lengths=SNAKE_LENGTHS, steps: int = NEXT_TICK_STEPS, repeats: int = REPEATS) -> dict:
+    # Binary against rich features: headless steps per second with the state extracted at every step, as in train(),
+    # and cost of a single extraction for snakes of growing length
+    rng = np.random.default_rng(SEED)
+    actions = [ACTIONS[i] for i in rng.integers(0, len(ACTIONS), steps)]
+    results = {}
+    for features in FEATURE_SIZES:
+        extract_state = main.state_extractor(features)
+        game = GameAI(headless=True)
+        start = time.perf_counter()
+        for action in actions:
+            if game.next_tick(action, 0)[2]:
+                game.reset()
+            extract_state(game)
+        results[f"{features}_features_steps_per_second"] = steps / (time.perf_counter() - start)
+        for length in lengths:
+            game = long_snake_game(length)
+            results[f"{features}_features_length_{length}_seconds"] = timeit(lambda: extract_state(game),
+                                                                             repeats * 100)
+    return results
+
+
+def bench_board_size(sizes=BOARD_SIZES, steps: int = NEXT_TICK_STEPS, repeats: int = REPEATS) -> dict:
+    # Headless steps per second (next_tick and get_state, with random actions) and reset latency for boards of
+    # size x size cells
+    rng = np.random.default_rng(SEED)
+    actions = [ACTIONS[i] for i in rng.integers(0, len(ACTIONS), steps)]
+    results = {}
+    for size in sizes:
+        game = GameAI(size, size, headless=True)
+        start = time.perf_counter()
+        for action in actions:
+            if game.next_tick(action, 0)[2]:
+                game.reset()
+            main.get_state(game)
+        results[f"board_{size}_steps_per_second"] = steps / (time.perf_counter() - start)
+        results[f"board_{size}_reset_seconds"] = timeit(game.reset, repeats)
+    return results
+
+
+def bench_train_memory(repeats: int = REPEATS) -> dict:
+    # Latency of Agent.train_short_memory (one transition) and Agent.train_long_memory (BATCH_SIZE transitions)
+    torch.manual_seed(SEED)
+    game_agent = Agent(seed=SEED)
+    # States of the configured feature set, the memory of the agent stores them in that format
+    states = game_states(2)
+    fill_memory(game_agent.memory, states)
+    return {
+        "train_short_memory_seconds": timeit(
+            lambda: game_agent.train_short_memory(states[0], (1, 0, 0), 0, states[1], False), repeats),
+        "train_long_memory_seconds": timeit(game_agent.train_long_memory, repeats),
+    }
+
+
+def bench_train(games: int = TRAIN_GAMES) -> dict:
+    # Headless end to end training from a fixed seed
+    start = time.perf_counter()
+    scores = main.train(headless=True, plotting=False, max_games=games, save_model=False, checkpoint_every=0,
+                        metrics_filename=None, seed=SEED)
+    seconds = time.perf_counter() - start
+    return {
+        "train_games_per_hour": len(scores) / seconds * 3600,
+        "train_seconds": seconds,
+    }
+
+
+def smoke(settings: dict = SMOKE_SETTINGS, games: int = SMOKE_GAMES) -> list:
+    # Train a few games with every settings of settings, returns the names of the ones that raised or stopped early
+    failures = []
+    for name, variant in settings.items():
+        try:
+            played = train_to_target(variant, None, games)[1]
+        except Exception as e:
+            print(f"smoke {name}: FAILED with {e!r}")
+            failures.append(name)
+            continue
+        if played < games:
+            print(f"smoke {name}: FAILED, {played} games played instead of {games}")
+            failures.append(name)
+        else:
+            print(f"smoke {name}: ok")
+    return failures
+
+
+BENCHMARKS = {
+    "next_tick": bench_next_tick,
+    "get_state": bench_get_state,
+    "features": bench_features,
+    "board_size": bench_board_size,
+    "train_memory": bench_train_memory,
+    "train": bench_train,
+    "train_step": bench_train_step,
+    "replay_sampling": bench_replay_sampling,
+    "prioritized_replay": bench_prioritized_replay,
+    "training_schedule": bench_training_schedule,
+    "target_network": bench_target_network,
+    "actors": bench_actors,
+    "action_selection": bench_action_selection,
+    "lookup_policy": bench_lookup_policy,
+    "export": bench_export,
+    "import_time": bench_import_time,
+}
+
+
+def higher_is_better(key: str) -> bool:
+    # Throughputs and agreements are better when higher, times and game counts when lower
+    return key.endswith(("per_second", "per_hour", "agreement"))
+
+
+def compare(results: dict, baseline: dict) -> list:
+    # Print every result next to its baseline value and return the keys that got worse by more than
+    # REGRESSION_TOLERANCE
+    regressions = []
+    for name, values in results.items():
+        for key, value in values.items():
+            if key not in baseline.get(name, {}):
+                continue
+            reference = baseline[name][key]
+            if reference:
+                change = (value - reference) / abs(reference)
+                tolerance = REGRESSION_TOLERANCE
+                change_text = f"{change:+.1%}"
+            else:
+                # No relative change from a zero baseline (e.g. files created at import): any change in the wrong
+                # direction is a regression
+                change = value - reference
+                tolerance = 0.0
+                change_text = f"{change:+.6g}"
+            worse = -change if higher_is_better(key) else change
+            flag = ""
+            if worse > tolerance:
+                regressions.append(key)
+                flag = "  REGRESSION"
+            print(f"{key}: {value:.6g} (baseline {reference:.6g}, {change_text}){flag}")
+    return regressions
+
+
+def run(names) -> dict:
+    results = {}
+    for name in names:
+        results[name] = BENCHMARKS[name]()
+        for key, value in results[name].items():
+            print(f"{key}: {value:.6g}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the benchmarks.")
+    parser.add_argument("names", nargs="*", metavar="name",
+                        help=f"benchmarks to run, among {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare the results with a JSON file written by --output")
+    parser.add_argument("--smoke", action="store_true",
+                        help="only check that every optional training path trains, exit with an error if not")
+    args = parser.parse_args()
+    if args.smoke:
+        sys.exit(1 if smoke() else 0)
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark {name}")
+    results = run(args.names or BENCHMARKS)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({
+                "machine": {"platform": platform.platform(), "processor": platform.processor(),
+                            "cpus": os.cpu_count(), "python": platform.python_version(), "torch": torch.__version__,
+                            "torch_threads": torch.get_num_threads()},
+                "results": results,
+            }, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)["results"]
+        print("\nComparison with the baseline:")
+        if compare(results, baseline):
+            sys.exit(1)
@@ -0,0 +1,121 @@
+"""
+Training checkpoints, written by a background thread so that the training loop never waits for the disk
+"""
+
+import os
+import queue
+import random
+import threading
+import numpy as np
+import torch
+from model import save_state_dict
+import logger_helper
+
+# --------------------------------------------------------
+# If not set, follow the default debug configuration
+DEBUG = None
+LOG_FILENAME = None
+DEBUG_FILENAME = None
+
+CHECKPOINT_FOLDER_PATH = "./checkpoints"
+# Save a checkpoint every CHECKPOINT_EVERY games (0 = never)
+CHECKPOINT_EVERY = 100
+# Number of most recent checkpoints kept on disk, older ones are deleted
+CHECKPOINTS_KEPT = 3
+# Snapshots waiting to be written, when the writer is this far behind the training loop waits for it
+MAX_PENDING_WRITES = 2
+# While waiting for the writer, check that it is still running every WRITER_CHECK_SECONDS seconds
+WRITER_CHECK_SECONDS = 1
+
+# --------------------------------------------------------
+
+# Set up logging
+logger = logger_helper.setup_logger(__name__, LOG_FILENAME, DEBUG, DEBUG_FILENAME)
+
+
+def rng_state() -> dict:
+    return {"random": random.getstate(), "numpy": np.random.get_state(), "torch": torch.get_rng_state()}
+
+
+def set_rng_state(state: dict):
+    random.setstate(state["random"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+
+
+class CheckpointManager:
+    def __init__(self, folder: str = CHECKPOINT_FOLDER_PATH, keep: int = CHECKPOINTS_KEPT):
+        self.folder = folder
+        self.keep = keep
+        self.jobs = queue.Queue(maxsize=MAX_PENDING_WRITES)
+        self.writer = threading.Thread(target=self.write_jobs, name="checkpoint-writer", daemon=True)
+        self.writer.start()
+
+    def checkpoint_files(self) -> list:
+        # Checkpoint files from the oldest to the most recent
+        if not os.path.exists(self.folder):
+            return []
+        return sorted(f for f in os.listdir(self.folder) if f.startswith("checkpoint_") and f.endswith(".pth"))
+
+    def save(self, n_games: int, checkpoint: dict):
+        # checkpoint must already be a copy of the training state (see Agent.state_dict), it is written later
+        self.put(("checkpoint", n_games, checkpoint))
+
+    def save_model(self, model: torch.nn.Module, filename: str = "model.pth"):
+        # Same as Linear_QNet.save, without waiting for the disk
+        self.put(("model", filename, {k: v.clone() for k, v in model.state_dict().items()}))
+
+    def put(self, job):
+        # Queue a job for the writer, raise instead of waiting forever on a full queue if the writer is gone
+        while True:
+            if not self.writer.is_alive():
+                raise RuntimeError("The checkpoint writer thread stopped, the checkpoint can't be written.")
+            try:
+                self.jobs.put(job, timeout=WRITER_CHECK_SECONDS)
+                return
+            except queue.Full:
+                pass
+
+    def load(self, path: str | None = None) -> dict | None:
+        # Load the given checkpoint, or the most recent one. Returns None if there's no checkpoint
+        if path is None:
+            files = self.checkpoint_files()
+            if not files:
+                return None
+            path = os.path.join(self.folder, files[-1])
+        logger.info(f"Loading checkpoint {path}.")
+        return torch.load(path, weights_only=False)
+
+    def close(self):
+        # Wait for the pending writes
+        self.put(None)
+        self.writer.join()
+
+    def write_jobs(self):
+        while (job := self.jobs.get()) is not None:
+            kind, name, data = job
+            try:
+                if kind == "model":
+                    save_state_dict(data, name)
+                else:
+                    self.write_checkpoint(name, data)
+            except Exception as e:
+                # Any failure (disk, pickling, torch) only loses this write, the writer keeps serving the next ones
+                logger.error(f"Couldn't write {kind} {name}: {e!r}")
+
+    def write_checkpoint(self, n_games: int, checkpoint: dict):
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+            logger.info(f"Folder not found, created one at path {self.folder}.")
+        path = os.path.join(self.folder, f"checkpoint_{n_games:09d}.pth")
+        # Write to a temporary file first, so that a run dying mid write never leaves a broken checkpoint
+        try:
+            torch.save(checkpoint, path + ".tmp")
+        except Exception:
+            if os.path.exists(path + ".tmp"):
+                os.remove(path + ".tmp")
+            raise
+        os.replace(path + ".tmp", path)
+        logger.info(f"Created checkpoint {path}.")
+        for old in self.checkpoint_files()[:-self.keep]:
+            os.remove(os.path.join(self.folder, old))
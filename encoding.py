@@ -0,0 +1,31 @@
+"""
+Bit-packed encoding of the binary game states
+"""
+
+import numpy as np
+
+# --------------------------------------------------------
+# Number of binary features of a state, as returned by main.get_state
+STATE_SIZE = 11
+# Number of distinct states
+N_STATES = 1 << STATE_SIZE
+
+# --------------------------------------------------------
+
+# Feature i of a state is bit i of its packed integer
+BIT_SHIFTS = np.arange(STATE_SIZE)
+BIT_WEIGHTS = 1 << BIT_SHIFTS
+
+
+def pack_states(states) -> np.ndarray:
+    # (N, STATE_SIZE) binary states to N packed integers
+    return (np.asarray(states, dtype=np.uint16) @ BIT_WEIGHTS).astype(np.uint16)
+
+
+def unpack_states(packed) -> np.ndarray:
+    # Packed integers to binary states, with one more trailing dimension of size STATE_SIZE
+    return ((np.asarray(packed)[..., None] >> BIT_SHIFTS) & 1).astype(np.uint8)
+
+
+# Every possible state, ALL_STATES[i] is the state packed as i
+ALL_STATES = unpack_states(np.arange(N_STATES))
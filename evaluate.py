@@ -0,0 +1,171 @@
+"""
+Greedy evaluation of a saved model over thousands of headless games, played in parallel processes
+"""
+
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import time
+import numpy as np
+import torch
+import gameAI
+from agent import greedy_table
+from features import FEATURE_SIZES
+from gameAI import GameAI, DEATH_CAUSES
+from main import state_extractor
+from model import Linear_QNet, MODEL_FOLDER_PATH
+import logger_helper
+
+# --------------------------------------------------------
+# If not set, follow the default debug configuration
+DEBUG = None
+LOG_FILENAME = None
+DEBUG_FILENAME = None
+
+EVAL_GAMES = 10_000
+# Game i of an evaluation is played with seed EVAL_SEED + i, so that every model plays the same food sequences
+EVAL_SEED = 0
+# Games are split in EVAL_CHUNKS chunks per process, so that the processes finish together
+EVAL_CHUNKS = 4
+# Score percentiles of the report
+PERCENTILES = (10, 25, 50, 75, 90, 99)
+
+# --------------------------------------------------------
+
+# Set up logging
+logger = logger_helper.setup_logger(__name__, LOG_FILENAME, DEBUG, DEBUG_FILENAME)
+
+
+def build_model(state: dict) -> Linear_QNet:
+    # Model with the layer sizes of the given weights
+    hidden_size, input_size = state["layer1.weight"].shape
+    model = Linear_QNet(input_size, hidden_size, state["layer2.weight"].shape[0])
+    model.load_state_dict(state)
+    model.eval()
+    return model
+
+
+def load_model(path: str) -> (Linear_QNet, str):
+    # Model saved by Linear_QNet.save or in a training checkpoint, and its feature set (from its input size)
+    state = torch.load(path, weights_only=False)
+    if "agent" in state:
+        state = state["agent"]["model"]
+    model = build_model(state)
+    input_size = model.layer1.in_features
+    features = next((name for name, size in FEATURE_SIZES.items() if size == input_size), None)
+    if features is None:
+        raise ValueError(f"{path} has {input_size} inputs, no feature set has this size.")
+    return model, features
+
+
+def init_worker():
+    # One torch thread per process, the processes already use every core. Every worker logs to its own files
+    logger_helper.setup_worker_logging()
+    torch.set_num_threads(1)
+
+
+def play(model_state: dict, features: str, seeds: range, cols: int, rows: int) -> dict:
+    # Play one greedy game per seed, in a worker process
+    model = build_model(model_state)
+    extract_state = state_extractor(features)
+    actions = list(gameAI.Action)
+    # With the binary features the whole greedy policy fits in a table of 2048 actions
+    table = greedy_table(model) if features == "binary" else None
+    scores = np.zeros(len(seeds), dtype=np.int64)
+    steps = np.zeros(len(seeds), dtype=np.int64)
+    causes = []
+    game = GameAI(cols, rows, headless=True, seed=seeds[0])
+    for i, seed in enumerate(seeds):
+        if i:
+            game.reset(seed)
+        game_over = False
+        while not game_over:
+            state = extract_state(game)
+            if table is not None:
+                option = table[state]
+            else:
+                with torch.no_grad():
+                    option = torch.argmax(model(torch.from_numpy(state))).item()
+            game_over = game.next_tick(actions[option])[2]
+        scores[i] = game.score
+        steps[i] = game.tick
+        causes.append(game.death_cause)
+    return {"scores": scores, "steps": steps, "causes": causes}
+
+
+def evaluate(path: str, games: int = EVAL_GAMES, workers: int | None = None, seed: int = EVAL_SEED,
+             cols: int | None = None, rows: int | None = None) -> dict:
+    # Play that many greedy games with the model at path, in parallel processes, and return the report. The board is
+    # gameAI.BOARD_COLS x gameAI.BOARD_ROWS by default, read at call time
+    if cols is None:
+        cols = gameAI.BOARD_COLS
+    if rows is None:
+        rows = gameAI.BOARD_ROWS
+    model, features = load_model(path)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    n_chunks = min(games, workers * EVAL_CHUNKS)
+    bounds = np.linspace(seed, seed + games, n_chunks + 1).astype(int).tolist()
+    model_state = model.state_dict()
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"),
+                                                initializer=init_worker) as pool:
+        futures = [pool.submit(play, model_state, features, range(low, high), cols, rows)
+                   for low, high in zip(bounds[:-1], bounds[1:])]
+        chunks = [future.result() for future in futures]
+    seconds = time.perf_counter() - start
+    scores = np.concatenate([c["scores"] for c in chunks])
+    steps = np.concatenate([c["steps"] for c in chunks])
+    causes = [cause for c in chunks for cause in c["causes"]]
+    return {
+        "model": path,
+        "features": features,
+        "games": games,
+        "mean_score": float(scores.mean()),
+        "std_score": float(scores.std()),
+        "min_score": int(scores.min()),
+        "max_score": int(scores.max()),
+        "percentiles": {p: float(v) for p, v in zip(PERCENTILES, np.percentile(scores, PERCENTILES))},
+        "score_counts": {int(s): int(n) for s, n in zip(*np.unique(scores, return_counts=True))},
+        "mean_steps": float(steps.mean()),
+        "death_causes": {cause: causes.count(cause) / games for cause in DEATH_CAUSES},
+        "seconds": seconds,
+        "games_per_second": games / seconds,
+        "steps_per_second": float(steps.sum()) / seconds,
+    }
+
+
+def format_report(report: dict) -> str:
+    percentiles = ", ".join(f"p{p}: {v:g}" for p, v in report["percentiles"].items())
+    causes = ", ".join(f"{cause}: {share:.1%}" for cause, share in report["death_causes"].items())
+    return "\n".join([
+        f"{report['model']} ({report['features']} features), {report['games']} games",
+        f"Score: mean {report['mean_score']:.2f} (std {report['std_score']:.2f}), min {report['min_score']}, "
+        f"max {report['max_score']}",
+        f"Percentiles: {percentiles}",
+        f"Mean game length: {report['mean_steps']:.1f} steps",
+        f"Death causes: {causes}",
+        f"Speed: {report['games_per_second']:,.1f} games/sec, {report['steps_per_second']:,.0f} steps/sec",
+    ])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate saved models with greedy games.")
+    parser.add_argument("paths", nargs="*", default=[os.path.join(MODEL_FOLDER_PATH, "model.pth")],
+                        help="saved models or training checkpoints")
+    parser.add_argument("--games", type=int, default=EVAL_GAMES, help="games played by every model")
+    parser.add_argument("--workers", type=int, help="parallel processes (default: one per core)")
+    parser.add_argument("--seed", type=int, default=EVAL_SEED, help="seed of the first game")
+    parser.add_argument("--cols", type=int, default=gameAI.BOARD_COLS, help="board width in cells, walls included")
+    parser.add_argument("--rows", type=int, default=gameAI.BOARD_ROWS, help="board height in cells, walls included")
+    parser.add_argument("--output", help="write the reports to this JSON file")
+    args = parser.parse_args()
+    reports = []
+    for model_path in args.paths:
+        reports.append(evaluate(model_path, args.games, args.workers, args.seed, args.cols, args.rows))
+        print(format_report(reports[-1]))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(reports, file, indent=2)
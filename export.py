@@ -0,0 +1,116 @@
+"""
+Export of a trained Linear_QNet for CPU inference: frozen TorchScript module, int8 dynamically quantized TorchScript
+module and NumPy weights for the torch free policy of numpy_policy.py
+"""
+
+import argparse
+import os
+import numpy as np
+import torch
+import torch.nn as nn
+import numpy_policy
+from encoding import ALL_STATES
+from evaluate import load_model
+from features import FEATURE_SIZES
+from model import Linear_QNet, MODEL_FOLDER_PATH
+import logger_helper
+
+# --------------------------------------------------------
+# If not set, follow the default debug configuration
+DEBUG = None
+LOG_FILENAME = None
+DEBUG_FILENAME = None
+
+EXPORT_FOLDER_PATH = os.path.join(MODEL_FOLDER_PATH, "export")
+# Rich states drawn at random for the parity check, the binary features are checked on every state
+PARITY_STATES = 10_000
+PARITY_SEED = 0
+
+# --------------------------------------------------------
+
+# Set up logging
+logger = logger_helper.setup_logger(__name__, LOG_FILENAME, DEBUG, DEBUG_FILENAME)
+
+# Exported variants and their file names
+EXPORT_FILENAMES = {
+    "torchscript": "model.torchscript.pt",
+    "quantized": "model.quantized.pt",
+    "numpy": "model.npz",
+}
+
+
+def export_torchscript(model: Linear_QNet, filename: str) -> torch.jit.ScriptModule:
+    # Scripted module with the weights frozen as constants, loadable with torch.jit.load without model.py
+    module = torch.jit.freeze(torch.jit.script(model.eval()))
+    module.save(filename)
+    return module
+
+
+def export_quantized(model: Linear_QNet, filename: str) -> torch.jit.ScriptModule:
+    # Linear layers with int8 weights, the activations are quantized on the fly at every forward pass
+    quantized = torch.ao.quantization.quantize_dynamic(model.eval(), {nn.Linear}, dtype=torch.qint8)
+    module = torch.jit.script(quantized)
+    module.save(filename)
+    return module
+
+
+def export_numpy(model: Linear_QNet, features: str, filename: str) -> numpy_policy.NumpyQNet:
+    weights = {name: tensor.detach().numpy() for name, tensor in model.state_dict().items()}
+    np.savez(filename, features=np.array(features), **weights)
+    return numpy_policy.load(filename)
+
+
+def export(model: Linear_QNet, features: str, folder: str = EXPORT_FOLDER_PATH) -> dict:
+    # Write every variant to folder, returns their file names
+    os.makedirs(folder, exist_ok=True)
+    filenames = {name: os.path.join(folder, filename) for name, filename in EXPORT_FILENAMES.items()}
+    export_torchscript(model, filenames["torchscript"])
+    export_quantized(model, filenames["quantized"])
+    export_numpy(model, features, filenames["numpy"])
+    logger.info(f"Model exported to {folder}.")
+    return filenames
+
+
+def parity_states(features: str, n_states: int = PARITY_STATES, seed: int = PARITY_SEED) -> np.ndarray:
+    # Every binary state, or random rich states
+    if features == "binary":
+        return ALL_STATES.astype(np.float32)
+    return np.random.default_rng(seed).random((n_states, FEATURE_SIZES[features]), dtype=np.float32)
+
+
+def greedy_actions(variant, states: np.ndarray) -> np.ndarray:
+    # Greedy actions of a torch module or of a NumpyQNet for an (N, features) batch of feature vectors, every variant
+    # takes the same 2-D input (the quantized linear layers reject single 1-D states)
+    if states.ndim != 2:
+        raise ValueError(f"Expected a batch of states of shape (N, features), got shape {states.shape}.")
+    if isinstance(variant, numpy_policy.NumpyQNet):
+        return np.argmax(variant(states), axis=1)
+    with torch.no_grad():
+        return torch.argmax(variant(torch.from_numpy(states)), dim=1).numpy()
+
+
+def action_agreement(model: Linear_QNet, variant, states: np.ndarray) -> float:
+    # Share of the states where the variant chooses the same action as the model
+    return float(np.mean(greedy_actions(model, states) == greedy_actions(variant, states)))
+
+
+def load_variants(filenames: dict) -> dict:
+    return {
+        "torchscript": torch.jit.load(filenames["torchscript"]),
+        "quantized": torch.jit.load(filenames["quantized"]),
+        "numpy": numpy_policy.load(filenames["numpy"]),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a saved model for CPU inference.")
+    parser.add_argument("path", nargs="?", default=os.path.join(MODEL_FOLDER_PATH, "model.pth"),
+                        help="saved model or training checkpoint")
+    parser.add_argument("--output", default=EXPORT_FOLDER_PATH, help="folder of the exported files")
+    args = parser.parse_args()
+    saved_model, saved_features = load_model(args.path)
+    exported = export(saved_model, saved_features, args.output)
+    states = parity_states(saved_features)
+    for name, exported_variant in load_variants(exported).items():
+        print(f"{exported[name]}: same action as the model on "
+              f"{action_agreement(saved_model, exported_variant, states):.2%} of {len(states)} states")
@@ -0,0 +1,164 @@
+"""
+Rich state features: distances to the nearest obstacle, reachable area after every move and distance to the tail,
+kept up to date incrementally from the occupancy grid of the game
+"""
+
+import numpy as np
+from encoding import STATE_SIZE, ALL_STATES
+from gameAI import Action, OccupancyGrid, parse_action
+import logger_helper
+
+# --------------------------------------------------------
+# If not set, follow the default debug configuration
+DEBUG = None
+LOG_FILENAME = None
+DEBUG_FILENAME = None
+
+# The flood fill of the reachable area stops once it reaches FLOOD_FILL_CAP times the snake length: a larger area is
+# as good as any other for the snake
+FLOOD_FILL_CAP = 2
+
+# --------------------------------------------------------
+
+# Set up logging
+logger = logger_helper.setup_logger(__name__, LOG_FILENAME, DEBUG, DEBUG_FILENAME)
+
+# Rays from the head in clockwise order from RIGHT: right, down right, down, down left, left, up left, up, up right
+N_RAYS = 8
+# Feature sets: "binary" is the 11 binary features of main.get_state, stored packed in a single integer.
+# "rich" adds the inverse distance to the nearest obstacle along every ray, the reachable area after every action
+# (STRAIGHT, RIGHT, LEFT) as a fraction of the flood fill cap and the distance from the head to the tail
+FEATURE_SIZES = {"binary": STATE_SIZE, "rich": STATE_SIZE + N_RAYS + len(Action) + 1}
+# How states are stored in the replay memory and sent between processes
+STATE_DTYPES = {"binary": np.uint16, "rich": np.float32}
+
+
+class RichFeatures:
+    # Obstacles (walls and snake) as bit masks of every row, column, diagonal and anti-diagonal of the board, and free
+    # cells as a single integer with bit y * cols + x for cell (x, y). They are built once per game from the occupancy
+    # grid, which then reports every cell taken or freed by the snake (see OccupancyGrid.observer)
+    def __init__(self):
+        self.grid = None
+        self.cols = 0
+        self.rows = 0
+        self.row_masks = []
+        self.col_masks = []
+        # Diagonal x - y + rows - 1 and anti-diagonal x + y, both indexed by x
+        self.diagonal_masks = []
+        self.anti_diagonal_masks = []
+        self.free = 0
+
+    def attach(self, grid: OccupancyGrid):
+        cols, rows = grid.cols, grid.rows
+        self.grid = grid
+        self.cols = cols
+        self.rows = rows
+        self.row_masks = [0] * rows
+        self.col_masks = [0] * cols
+        self.diagonal_masks = [0] * (cols + rows - 1)
+        self.anti_diagonal_masks = [0] * (cols + rows - 1)
+        count = np.frombuffer(grid.count, dtype=np.uint8)
+        inside = np.frombuffer(grid.inside, dtype=np.uint8)
+        free = (count == 0) & (inside == 1)
+        self.free = int.from_bytes(np.packbits(free, bitorder="little").tobytes(), "little")
+        for cell in np.flatnonzero(~free).tolist():
+            self.set_obstacle(cell)
+        grid.observer = self
+
+    def set_obstacle(self, cell: int):
+        y, x = divmod(cell, self.cols)
+        self.row_masks[y] |= 1 << x
+        self.col_masks[x] |= 1 << y
+        self.diagonal_masks[x - y + self.rows - 1] |= 1 << x
+        self.anti_diagonal_masks[x + y] |= 1 << x
+
+    def occupy(self, cell: int):
+        self.set_obstacle(cell)
+        self.free &= ~(1 << cell)
+
+    def release(self, cell: int):
+        y, x = divmod(cell, self.cols)
+        self.row_masks[y] &= ~(1 << x)
+        self.col_masks[x] &= ~(1 << y)
+        self.diagonal_masks[x - y + self.rows - 1] &= ~(1 << x)
+        self.anti_diagonal_masks[x + y] &= ~(1 << x)
+        self.free |= 1 << cell
+
+    def rays(self, x: int, y: int) -> list:
+        # Inverse of the number of steps from (x, y) to the nearest obstacle along every ray, 0 if there's none (only
+        # possible from a head already in the wall)
+        row = self.row_masks[y]
+        col = self.col_masks[x]
+        diagonal = self.diagonal_masks[x - y + self.rows - 1]
+        anti_diagonal = self.anti_diagonal_masks[x + y]
+        below_x = (1 << x) - 1
+        return [
+            after(row >> (x + 1)),
+            after(diagonal >> (x + 1)),
+            after(col >> (y + 1)),
+            before(anti_diagonal & below_x, x),
+            before(row & below_x, x),
+            before(diagonal & below_x, x),
+            before(col & ((1 << y) - 1), y),
+            after(anti_diagonal >> (x + 1)),
+        ]
+
+    def reachable_areas(self, snake) -> list:
+        # Free area reachable from the cell reached by every action, as a fraction of the flood fill cap. Cells free now
+        # are counted, the tail leaving its cells is ignored
+        cap = FLOOD_FILL_CAP * snake.length
+        areas = []
+        regions = []
+        for action in Action:
+            dx, dy = parse_action(action, snake.direction).value
+            x, y = snake.head_x + dx, snake.head_y + dy
+            if not (0 <= x < self.cols and 0 <= y < self.rows) or not self.free >> (y * self.cols + x) & 1:
+                areas.append(0.0)
+                continue
+            start = 1 << (y * self.cols + x)
+            # Moves leading to a region already filled share its area
+            area = next((area for region, area in regions if region & start), None)
+            if area is None:
+                region, area = flood_fill(self.free, start, self.cols, cap)
+                regions.append((region, area))
+            areas.append(min(area, cap) / cap)
+        return areas
+
+    def __call__(self, game, state: int) -> np.ndarray:
+        # Rich state of the game, state is its packed binary state (see main.get_state)
+        snake = game.snake
+        if snake.grid is not self.grid:
+            self.attach(snake.grid)
+        x, y = snake.head_x, snake.head_y
+        tail = snake.body[-1] if snake.body else snake.head_cell
+        tail_y, tail_x = divmod(tail, self.cols)
+        features = np.empty(FEATURE_SIZES["rich"], dtype=np.float32)
+        features[:STATE_SIZE] = ALL_STATES[state]
+        features[STATE_SIZE:STATE_SIZE + N_RAYS] = self.rays(x, y)
+        features[STATE_SIZE + N_RAYS:-1] = self.reachable_areas(snake)
+        features[-1] = (abs(x - tail_x) + abs(y - tail_y)) / (self.cols + self.rows)
+        return features
+
+
+def after(mask: int) -> float:
+    # mask has bit i set if there's an obstacle i + 1 steps away
+    return 1 / (mask & -mask).bit_length() if mask else 0.0
+
+
+def before(mask: int, position: int) -> float:
+    # mask has bit i set if there's an obstacle at position i, below position
+    return 1 / (position - mask.bit_length() + 1) if mask else 0.0
+
+
+def flood_fill(free: int, start: int, cols: int, cap: int) -> (int, int):
+    # Grow the region from start one step in every direction at a time, with whole board bit operations, until it
+    # stops growing or covers cap cells. The walls keep the shifts by one cell from wrapping around the rows
+    region = start
+    area = 1
+    while area < cap:
+        grown = (region | region << 1 | region >> 1 | region << cols | region >> cols) & free
+        if grown == region:
+            break
+        region = grown
+        area = region.bit_count()
+    return region, area
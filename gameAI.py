@@ -2,11 +2,11 @@
 Game modified for the AI
 """
 
-import pygame
-from pygame import Vector2
 from enum import Enum
 import random
+from collections import deque
 import logger_helper
+import profiler
 
 # --------------------------------------------------------
 # If not set, follow the default debug configuration
@@ -18,7 +18,10 @@ DEBUG_FILENAME = None
 SCREEN_WIDTH = 640
 # Window height
 SCREEN_HEIGHT = 480
-# Unit size
+# Board size in cells, walls included
+BOARD_COLS = 32
+BOARD_ROWS = 24
+# Cell size in pixels, smaller on boards that don't fit in the window with cells of this size
 SECTION_SIZE = 20
 # Base game speed
 SPEED = 100
@@ -26,17 +29,23 @@ SPEED = 100
 FONT_SIZE = 25
 # Maximum number of moves the Agent can take per snake length before the game is reset
 STEPS_PER_LENGTH = 50
+# Run without a window: no display, no event pump, no drawing and no clock throttling
+HEADLESS = False
+# Reasons a game ends, see GameAI.death_cause
+DEATH_CAUSES = ("wall", "self", "timeout")
+# Draw only one game every RENDER_EVERY games (0 = never draw unless requested with GameAI.request_render)
+RENDER_EVERY = 1
 
 
 # --------------------------------------------------------
 
 # Absolute directions
 class Direction(Enum):
-    NONE = Vector2(0, 0)
-    RIGHT = Vector2(1, 0)
-    DOWN = Vector2(0, 1)
-    LEFT = Vector2(-1, 0)
-    UP = Vector2(0, -1)
+    NONE = (0, 0)
+    RIGHT = (1, 0)
+    DOWN = (0, 1)
+    LEFT = (-1, 0)
+    UP = (0, -1)
 
 
 clockwise_directions = [d for d in Direction if d.name != "NONE"]
@@ -51,9 +60,18 @@ class Action(Enum):
 # Set up logging
 logger = logger_helper.setup_logger(__name__, LOG_FILENAME, DEBUG, DEBUG_FILENAME)
 
+# pygame is only imported once a game opens a window or draws a frame, headless games never load it
+pygame = None
+
+
+def load_pygame():
+    global pygame
+    if pygame is None:
+        import pygame
+    return pygame
+
 
 def parse_action(action: Action, direction: Direction) -> Direction:
-    debug_message = f"Parsing action: {action} with direction {direction}. "
     idx = clockwise_directions.index(direction)
     match action:
         case Action.STRAIGHT:
@@ -66,8 +84,9 @@ def parse_action(action: Action, direction: Direction) -> Direction:
             new_idx = (idx - 1) % 4
         case _:
             raise ValueError(f"Couldn't parse action {action}.")
-    debug_message += f"New direction is {clockwise_directions[new_idx]}."
-    logger.debug(debug_message)
+    if logger_helper.tracing(logger):
+        logger.debug(f"Parsing action: {action} with direction {direction}. "
+                     f"New direction is {clockwise_directions[new_idx]}.")
     return clockwise_directions[new_idx]
 
 
@@ -80,61 +99,120 @@ class Color(Enum):
     BLUE = (8, 21, 77)
 
 
+class OccupancyGrid:
+    # Free cells and inside mask of an empty board for every board size, copied by every new grid of that size
+    empty_boards = {}
+
+    def __init__(self, cols: int, rows: int):
+        self.cols = cols
+        self.rows = rows
+        # Number of snake sections (head included) in every cell
+        self.count = bytearray(cols * rows)
+        # Cells inside the walls not covered by the snake, with the position of every cell in free_cells
+        # (-1 if not free) so that a cell can be removed in O(1) by swapping it with the last one
+        if (cols, rows) not in OccupancyGrid.empty_boards:
+            free_cells = [y * cols + x for y in range(1, rows - 1) for x in range(1, cols - 1)]
+            free_index = [-1] * (cols * rows)
+            inside = bytearray(cols * rows)
+            for i, cell in enumerate(free_cells):
+                free_index[cell] = i
+                inside[cell] = 1
+            OccupancyGrid.empty_boards[cols, rows] = (free_cells, free_index, bytes(inside))
+        free_cells, free_index, self.inside = OccupancyGrid.empty_boards[cols, rows]
+        self.free_cells = free_cells.copy()
+        self.free_index = free_index.copy()
+        # Object told about every cell inside the walls taken (occupy(cell)) or freed (release(cell)) by the snake, used
+        # to keep derived data up to date incrementally (see features.py)
+        self.observer = None
+
+    def add(self, cell: int):
+        self.count[cell] += 1
+        i = self.free_index[cell]
+        if i >= 0:
+            last = self.free_cells.pop()
+            if last != cell:
+                self.free_cells[i] = last
+                self.free_index[last] = i
+            self.free_index[cell] = -1
+            if self.observer is not None:
+                self.observer.occupy(cell)
+
+    def remove(self, cell: int):
+        self.count[cell] -= 1
+        if self.count[cell] == 0 and self.is_inside(cell):
+            self.free_index[cell] = len(self.free_cells)
+            self.free_cells.append(cell)
+            if self.observer is not None:
+                self.observer.release(cell)
+
+    def is_inside(self, cell: int) -> bool:
+        return self.inside[cell] == 1
+
+    def random_free(self, rng: random.Random = random) -> int | None:
+        if not self.free_cells:
+            return None
+        return rng.choice(self.free_cells)
+
+
 class Food:
-    def __init__(self, screen: pygame.display, x: int = 0, y: int = 0):
-        self.screen = screen
-        self.pos = Vector2(self.randomize())
+    def __init__(self, cell: int, cols: int):
+        self.cell = cell
+        self.x = cell % cols
+        self.y = cell // cols
 
-    def draw(self):
-        pygame.draw.rect(self.screen, Color.RED.value, (self.pos.x, self.pos.y, SECTION_SIZE, SECTION_SIZE))
+    def draw(self, screen: "pygame.Surface", cell_size: int):
+        pygame.draw.rect(screen, Color.RED.value, (self.x * cell_size, self.y * cell_size, cell_size, cell_size))
 
     def __str__(self):
-        return f"Food at position {self.pos}."
-
-    def randomize(self):
-        width, height = self.screen.get_size()
-        x = random.randint(1, (width - 2 * SECTION_SIZE) // SECTION_SIZE) * SECTION_SIZE
-        y = random.randint(1, (height - 2 * SECTION_SIZE) // SECTION_SIZE) * SECTION_SIZE
-        return x, y
+        return f"Food at cell ({self.x}, {self.y})."
 
 
 class Snake:
-    def __init__(self, screen: pygame.display, length: int = 3, x: int = 0, y: int = 0,
+    def __init__(self, cols: int, rows: int, length: int = 3, x: int = 0, y: int = 0,
                  direction: Direction = Direction.RIGHT):
-        self.screen = screen
+        self.cols = cols
         self.length = length
-        self.head = Vector2(x, y)
+        # Head position in cells, and its flat index y * cols + x
+        self.head_x = x
+        self.head_y = y
+        self.head_cell = y * cols + x
         self.direction = direction
-        self.body = [Vector2(self.head.x - i * SECTION_SIZE, self.head.y) for i in range(1, length)]
+        # Flat cell index of every section after the head
+        self.body = deque(self.head_cell - i for i in range(1, length))
         # Check if we need to add a new section on next movement
         self.new_section = False
+        # Occupancy of the board, updated on every movement
+        self.grid = OccupancyGrid(cols, rows)
+        self.grid.add(self.head_cell)
+        for cell in self.body:
+            self.grid.add(cell)
 
-    def draw(self):
+    def draw(self, screen: "pygame.Surface", cell_size: int):
         # Draw head
         # Base section
-        pygame.draw.rect(self.screen, Color.DARK_GREEN.value, (self.head.x, self.head.y, SECTION_SIZE, SECTION_SIZE))
+        x, y = self.head_x * cell_size, self.head_y * cell_size
+        pygame.draw.rect(screen, Color.DARK_GREEN.value, (x, y, cell_size, cell_size))
 
         # Lighter inline
-        pygame.draw.rect(self.screen, Color.LIGHT_GREEN.value, (self.head.x + SECTION_SIZE / 5, self.head.y +
-                                                                SECTION_SIZE / 5,
-                                                                3 * SECTION_SIZE / 5, 3 * SECTION_SIZE / 5))
+        pygame.draw.rect(screen, Color.LIGHT_GREEN.value, (x + cell_size / 5, y + cell_size / 5,
+                                                           3 * cell_size / 5, 3 * cell_size / 5))
         # Draw body
-        for s in self.body:
+        for cell in self.body:
             # Base section
-            pygame.draw.rect(self.screen, Color.DARK_GREEN.value, (s.x, s.y, SECTION_SIZE, SECTION_SIZE))
-
-            # Lighter inline
-            # pygame.draw.rect(self.screen, Color.LIGHT_GREEN.value, (s.x + SECTION_SIZE / 5, s.y + SECTION_SIZE / 5,
-            #                                                         3 * SECTION_SIZE / 5, 3 * SECTION_SIZE / 5))
+            pygame.draw.rect(screen, Color.DARK_GREEN.value, (cell % self.cols * cell_size,
+                                                              cell // self.cols * cell_size, cell_size, cell_size))
 
     def move(self):
         if self.direction == Direction.NONE:
             return
-        old_head = self.head.copy()
-        self.body.insert(0, old_head)
-        self.head += self.direction.value * SECTION_SIZE
+        self.body.appendleft(self.head_cell)
+        dx, dy = self.direction.value
+        self.head_x += dx
+        self.head_y += dy
+        self.head_cell += dy * self.cols + dx
+        self.grid.add(self.head_cell)
         if not self.new_section:
-            self.body.pop()
+            self.grid.remove(self.body.pop())
         else:
             self.length += 1
             self.new_section = False
@@ -142,50 +220,120 @@ class Snake:
     def add_section(self):
         self.new_section = True
 
-    def get_head_vertexes(self) -> [Vector2]:
-        v_topl = self.head
-        v_topr = self.head + Direction.RIGHT.value * SECTION_SIZE
-        v_botl = self.head + Direction.DOWN.value * SECTION_SIZE
-        v_botr = self.head + Direction.DOWN.value * SECTION_SIZE + Direction.RIGHT.value * SECTION_SIZE
-        return [v_topl, v_topr, v_botr, v_botl]
+    def in_body(self, cell: int) -> bool:
+        # Constant time equivalent of cell in self.body: the head doesn't count as a body section
+        return self.grid.count[cell] > (cell == self.head_cell)
 
 
 class GameAI:
-    def __init__(self, width: int = SCREEN_WIDTH, height: int = SCREEN_HEIGHT):
-        pygame.init()
-        # Game window dimensions
-        self.width = width
-        self.height = height
-        # Create display
-        self.screen = pygame.display.set_mode((self.width, self.height))
-        pygame.display.set_caption("Snake Game")
-        # Clock
-        self.clock = pygame.time.Clock()
-        # Font
-        self.font = pygame.font.Font(None, FONT_SIZE)
+    def __init__(self, cols: int | None = None, rows: int | None = None, headless: bool | None = None,
+                 render_every: int | None = None, seed: int | None = None):
+        # Board dimensions in cells (BOARD_COLS x BOARD_ROWS by default), the game logic never deals with pixels. The
+        # settings left to None are read at call time so that swept values are followed
+        if cols is None:
+            cols = BOARD_COLS
+        if rows is None:
+            rows = BOARD_ROWS
+        if headless is None:
+            headless = HEADLESS
+        if render_every is None:
+            render_every = RENDER_EVERY
+        self.cols = cols
+        self.rows = rows
+        # Game window dimensions, the board is drawn in its top left corner
+        self.width = SCREEN_WIDTH
+        self.height = SCREEN_HEIGHT
+        self.cell_size = max(1, min(SECTION_SIZE, self.width // cols, self.height // rows))
+        self.headless = headless
+        self.render_every = render_every
+        if self.headless:
+            # No window and no clock, frames are only drawn (off-screen) when explicitly requested, on a surface created
+            # with the first one
+            self.screen = None
+            self.clock = None
+        else:
+            load_pygame().init()
+            # Create display
+            self.screen = pygame.display.set_mode((self.width, self.height))
+            pygame.display.set_caption("Snake Game")
+            # Clock
+            self.clock = pygame.time.Clock()
+        # Font, created the first time the score is drawn
+        self.font = None
+        # Rendering control
+        self.n_games = 0
+        self.render_requested = False
+        self.rendering = self.should_render()
+        # Every game draws its food from its own generator, so that a game is entirely defined by its seed and its
+        # actions (see trajectory.py). The seeds are drawn from the global random module unless given
+        self.seed = None
+        self.rng = None
         # Initial game state
         # Snake starts at length 3, at the center of the screen, facing right
-        self.snake = Snake(self.screen, length=3, x=width // 2, y=height // 2)
+        self.snake = None
         self.score = 0
         self.food = None
-        self.place_food()
         # Attributes needed for the AI
         self.tick = 0
-
-    def reset(self):
+        # One of DEATH_CAUSES once the game is over
+        self.death_cause = None
+        self.new_game(seed)
+
+    def reset(self, seed: int | None = None):
+        self.n_games += 1
+        self.rendering = self.should_render()
+        self.new_game(seed)
+
+    def new_game(self, seed: int | None = None):
+        self.seed = random.getrandbits(32) if seed is None else seed
+        self.rng = random.Random(self.seed)
         self.tick = 0
-        self.snake = Snake(self.screen, length=3, x=self.width // 2, y=self.height // 2)
+        self.death_cause = None
+        self.snake = Snake(self.cols, self.rows, length=3, x=self.cols // 2, y=self.rows // 2)
         self.score = 0
         self.place_food()
 
+    # Game counter, seed, generator and food of a game that just started, the snake always starts from the same position
+    def state_dict(self) -> dict:
+        return {"n_games": self.n_games, "seed": self.seed, "rng": self.rng.getstate(),
+                "food": self.food.cell}
+
+    def load_state_dict(self, state: dict):
+        self.n_games = state["n_games"]
+        self.rendering = self.should_render()
+        self.seed = state["seed"]
+        self.rng.setstate(state["rng"])
+        self.food = Food(state["food"], self.cols)
+
+    def should_render(self) -> bool:
+        # A requested render always wins, otherwise draw one game every render_every games
+        if self.render_requested:
+            self.render_requested = False
+            return True
+        if self.headless or self.render_every <= 0:
+            return False
+        return self.n_games % self.render_every == 0
+
+    def request_render(self, now: bool = False):
+        # Draw the next game, or the current one from the next tick if now is set
+        if now:
+            self.rendering = True
+        else:
+            self.render_requested = True
+
     def next_tick(self, action: Action, speed: int = SPEED) -> (int, int, bool):
         self.tick += 1
+        logger_helper.tracer.next_tick()
         reward = 0
         game_over = False
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                quit()
+        if not self.headless:
+            # Keep the window responsive even when the current game isn't drawn
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    pygame.quit()
+                    quit()
+        timer = profiler.timer
+        timer.lap("events")
         self.snake.direction = parse_action(action, self.snake.direction)
         # Move snake
         self.snake.move()
@@ -196,70 +344,90 @@ class GameAI:
             self.place_food()
             self.snake.add_section()
         # Check game over
-        if self.is_collision() or self.tick > STEPS_PER_LENGTH * self.snake.length:
+        if self.wall_collision():
+            self.death_cause = "wall"
+        elif self.snake_collision():
+            self.death_cause = "self"
+        elif self.tick > STEPS_PER_LENGTH * self.snake.length:
+            self.death_cause = "timeout"
+        if self.death_cause is not None:
             reward = -10
             game_over = True
+            timer.lap("move")
             return reward, self.score, game_over
-        # update ui and clock
-        self.update_ui()
-        self.clock.tick(speed)
+        timer.lap("move")
+        # update ui and clock, only for the games we are watching
+        if self.rendering:
+            self.update_ui()
+            timer.lap("render")
+            if self.clock is not None:
+                self.clock.tick(speed)
+                timer.lap("clock")
 
         return reward, self.score, game_over
 
     def place_food(self):
-        self.food = Food(self.screen)
-        # If the food is spawned in the snake, replace it
-        if self.food.pos in self.snake.body:
-            self.place_food()
-        else:
-            self.food = Food(self.screen)
+        # Spawn the food in one of the cells not covered by the snake
+        cell = self.snake.grid.random_free(self.rng)
+        if cell is None:
+            logger.info("The snake covers the whole board, no space left for food.")
+            return
+        self.food = Food(cell, self.cols)
 
     def update_ui(self):
+        if self.screen is None:
+            self.screen = load_pygame().Surface((self.width, self.height))
         # Fill display
         self.screen.fill(Color.BLACK.value)
         # Draw outer walls
         self.draw_walls()
         # Draw snake
-        self.snake.draw()
+        self.snake.draw(self.screen, self.cell_size)
         #Draw food
-        self.food.draw()
+        self.food.draw(self.screen, self.cell_size)
         self.display_score()
-        pygame.display.flip()
+        if not self.headless:
+            pygame.display.flip()
 
     def display_score(self):
+        if self.font is None:
+            pygame.font.init()
+            self.font = pygame.font.Font(None, FONT_SIZE)
         text = self.font.render(f"Score: {self.score}", True, Color.WHITE.value)
         self.screen.blit(text, [0, 0])
 
-    def is_collision(self, direction: Vector2 = Direction.NONE):
+    def is_collision(self, direction: Direction = Direction.NONE):
         return self.wall_collision(direction) or self.snake_collision(direction)
 
-    def wall_collision(self, direction: Vector2 = Direction.NONE):
-        x = self.snake.head.x + direction.value[0] * SECTION_SIZE
-        y = self.snake.head.y + direction.value[1] * SECTION_SIZE
+    def wall_collision(self, direction: Direction = Direction.NONE):
+        x = self.snake.head_x + direction.value[0]
+        y = self.snake.head_y + direction.value[1]
 
-        if x < SECTION_SIZE or x > self.width - 2 * SECTION_SIZE:
-            logger.debug("Collision! Vertical wall hit.")
+        if x < 1 or x > self.cols - 2:
+            if logger_helper.tracing(logger):
+                logger.debug("Collision! Vertical wall hit.")
             return True
-        if y < SECTION_SIZE or y > self.height - 2 * SECTION_SIZE:
-            logger.debug("Collision! Horizontal wall hit.")
+        if y < 1 or y > self.rows - 2:
+            if logger_helper.tracing(logger):
+                logger.debug("Collision! Horizontal wall hit.")
             return True
         return False
 
-    def snake_collision(self, direction: Vector2 = Direction.NONE):
-        if self.snake.head + direction.value * SECTION_SIZE in self.snake.body:
-            logger.debug("Body collision.")
+    def snake_collision(self, direction: Direction = Direction.NONE):
+        # Only valid for a cell inside the walls, see is_collision
+        dx, dy = direction.value
+        if self.snake.in_body(self.snake.head_cell + dy * self.cols + dx):
+            if logger_helper.tracing(logger):
+                logger.debug("Body collision.")
             return True
         return False
 
     def food_collision(self):
-        if self.food.pos.x + SECTION_SIZE > self.snake.head.x > self.food.pos.x - SECTION_SIZE:
-            if self.food.pos.y + SECTION_SIZE > self.snake.head.y > self.food.pos.y - SECTION_SIZE:
-                return True
-        return False
+        return self.snake.head_cell == self.food.cell
 
     def draw_walls(self):
-        rect = self.screen.get_rect()
-        pygame.draw.rect(self.screen, Color.BLUE.value, rect, width=SECTION_SIZE)
+        rect = (0, 0, self.cols * self.cell_size, self.rows * self.cell_size)
+        pygame.draw.rect(self.screen, Color.BLUE.value, rect, width=self.cell_size)
 
     def game_over(self):
         log_message = f"Game over! Score is {self.score}."
@@ -1,5 +1,9 @@
+import atexit
 import logging
+import logging.handlers
 import os
+import queue
+import threading
 
 # --------------------------------------------------------
 # Set global level of debugging
@@ -9,6 +13,8 @@ GLOBAL_DEBUG = False
 GLOBAL_LOG_FILENAME = "log.log"
 GLOBAL_DEBUG_FILENAME = "debug.log"
 LOGGING_LEVEL = logging.INFO
+# Debug traces of the hot path (game ticks, states, actions) are only written for one tick every DEBUG_SAMPLE_EVERY
+DEBUG_SAMPLE_EVERY = 1
 
 # Local logging
 DEBUG = None
@@ -23,8 +29,109 @@ str_console_format = "[%(levelname)s - %(name)s] - %(message)s"
 date_format = "%H:%M:%S"
 file_formatter = logging.Formatter(str_file_format, datefmt=date_format)
 console_formatter = logging.Formatter(str_console_format, datefmt=date_format)
-# Set of every file the loggers are writing to
-logging_filelist = set()
+# Background listener writing each file, fed by a queue so that the callers never wait for the disk. A file and its
+# listener are only created when the first record is written to it, importing a module has no side effect
+file_listeners = {}
+file_listeners_lock = threading.Lock()
+# Every file handler created by setup_logger, and the suffix added to their file names in a worker process (see
+# setup_worker_logging)
+file_handlers = []
+worker_suffix = None
+
+
+class TickTracer:
+    # Decides which ticks of the game loop are traced, so that debug logs can be sampled
+    def __init__(self, every: int = DEBUG_SAMPLE_EVERY):
+        self.every = every
+        self.tick = 0
+        self.active = True
+
+    def next_tick(self):
+        self.tick += 1
+        self.active = self.tick % self.every == 0
+
+
+tracer = TickTracer()
+
+
+def tracing(logger: logging.Logger) -> bool:
+    # Check it before building a debug message on the hot path: no formatting work unless the logger is at debug level
+    # and the current tick is sampled
+    return tracer.active and logger.isEnabledFor(logging.DEBUG)
+
+
+class DirectWriter:
+    # Stand-in for the queue of a background writer, writing every record right away. Worker processes use it: they
+    # exit without running the atexit hooks that stop the background writers, which would lose their last records
+    def __init__(self, file_handler: logging.Handler):
+        self.file_handler = file_handler
+
+    def put_nowait(self, record: logging.LogRecord):
+        self.file_handler.handle(record)
+
+
+def worker_filename(filename: str) -> str:
+    # log.log becomes log.<suffix>.log in a worker process
+    if worker_suffix is None:
+        return filename
+    root, extension = os.path.splitext(filename)
+    return f"{root}.{worker_suffix}{extension}"
+
+
+def file_queue(filename: str) -> queue.SimpleQueue | DirectWriter:
+    # Queue of the background writer of filename, started on first use. The file is wiped when it is first opened
+    filename = worker_filename(filename)
+    with file_listeners_lock:
+        if filename not in file_listeners:
+            file_handler = logging.FileHandler(filename, mode="w")
+            file_handler.setFormatter(file_formatter)
+            if worker_suffix is not None:
+                file_listeners[filename] = (DirectWriter(file_handler), None)
+            else:
+                records = queue.SimpleQueue()
+                listener = logging.handlers.QueueListener(records, file_handler)
+                listener.start()
+                file_listeners[filename] = (records, listener)
+        return file_listeners[filename][0]
+
+
+def setup_worker_logging(name: str | None = None):
+    # Call first thing in a worker process (sweep, evaluation, actors): its records go to its own files, log.<name>.log
+    # (name defaults to the process id), written without a background thread. Under fork the queues inherited from the
+    # parent are dropped, their writer threads don't exist in the child
+    global worker_suffix, file_listeners, file_listeners_lock
+    worker_suffix = str(os.getpid()) if name is None else name
+    file_listeners = {}
+    file_listeners_lock = threading.Lock()
+    for handler in file_handlers:
+        handler.queue = None
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    # Handler putting records in the queue of the background writer of filename, created with the first record
+    def __init__(self, filename: str):
+        super().__init__(None)
+        self.filename = filename
+
+    def enqueue(self, record: logging.LogRecord):
+        if self.queue is None:
+            self.queue = file_queue(self.filename)
+        self.queue.put_nowait(record)
+
+
+def queue_file_handler(filename: str, level: int) -> logging.Handler:
+    handler = LazyQueueHandler(filename)
+    handler.setLevel(level)
+    file_handlers.append(handler)
+    return handler
+
+
+@atexit.register
+def stop_file_listeners():
+    # Write the records still in the queues
+    for records, listener in file_listeners.values():
+        if listener is not None:
+            listener.stop()
 
 
 def setup_logger(name: str, log_filename: str | None, debug: bool | None, debug_filename: str | None) -> logging.Logger:
@@ -34,36 +141,24 @@ def setup_logger(name: str, log_filename: str | None, debug: bool | None, debug_
         log_filename = GLOBAL_LOG_FILENAME
     if debug_filename is None:
         debug_filename = GLOBAL_DEBUG_FILENAME
-    # If the logging file haven't been set yet but already exists, we wipe it before opening the file stream
-    if log_filename not in logging_filelist:
-        if os.path.exists(log_filename):
-            os.remove(log_filename)
-        logging_filelist.add(log_filename)
-    if debug_filename not in logging_filelist:
-        if os.path.exists(debug_filename):
-            os.remove(debug_filename)
-        logging_filelist.add(debug_filename)
-
     logger = logging.getLogger(name)
-    logger.setLevel(logging.DEBUG)
+    # Calling it again for the same name returns the logger already set up instead of adding more handlers
+    if logger.handlers:
+        return logger
+    # Debug records are discarded by the logger itself (before any formatting) when debugging is off
+    logger.setLevel(logging.DEBUG if debug else LOGGING_LEVEL)
     # Always add a standard streamhandler for high priority messages (warning++)
     console_handler = logging.StreamHandler()
     console_handler.setLevel(logging.WARNING)
     console_handler.setFormatter(console_formatter)
     logger.addHandler(console_handler)
     # Always add a standard filehandler that logs to log_filename
-    handler = logging.FileHandler(log_filename)
-    handler.setLevel(LOGGING_LEVEL)
-    handler.setFormatter(file_formatter)
-    logger.addHandler(handler)
+    logger.addHandler(queue_file_handler(log_filename, LOGGING_LEVEL))
     # If debugging is enabled, add a debugging file handler
     if debug:
-        debug_handler = logging.FileHandler(debug_filename)
-        debug_handler.setLevel(logging.DEBUG)
-        debug_handler.setFormatter(file_formatter)
-        logger.addHandler(debug_handler)
-    log_message = "Logger activated with debug " + ("ON" if debug else "OFF")
-    logger.info(log_message)
+        logger.addHandler(queue_file_handler(debug_filename, logging.DEBUG))
+    # Only written with debugging on, so that setting up a logger doesn't create its files
+    logger.debug("Logger activated with debug ON")
     return logger
 
 
@@ -1,5 +1,23 @@
-from gameAI import GameAI, Direction, parse_action, Action
-from plot import plot
+import argparse
+import os
+import random
+import subprocess
+import sys
+import time
+import numpy as np
+import torch
+from gameAI import GameAI, Direction, parse_action, Action, clockwise_directions
+import gameAI
+import encoding
+import checkpoint
+import metrics
+import profiler
+import trajectory
+from checkpoint import CheckpointManager
+from metrics import MetricsWriter
+from features import RichFeatures
+from profiler import GameWindowProfiler
+from trajectory import TrajectoryWriter
 import logger_helper
 from agent import Agent
 import agent
@@ -9,28 +27,51 @@ import agent
 DEBUG = None
 LOG_FILENAME = None
 DEBUG_FILENAME = None
+
+# Number of most recent games averaged to check if the target score of train() is reached
+TARGET_WINDOW = 100
 # --------------------------------------------------------
 
 
 # Set up logging
 logger = logger_helper.setup_logger(__name__, LOG_FILENAME, DEBUG, DEBUG_FILENAME)
 
+# Bit of the packed state set by every direction, the direction features are bits 3 to 6
+DIRECTION_BITS = {d: 1 << (3 + i) for i, d in enumerate(clockwise_directions)}
+
 
-def get_state(game):
-    danger = [int(game.is_collision(parse_action(a, game.snake.direction))) for a in Action]
-    direction = [int(game.snake.direction == d) for d in Direction if d != Direction.NONE]
-    food = [
-        int(game.food.pos.x > game.snake.head.x),  # food right
-        int(game.food.pos.y > game.snake.head.y),  # food down
-        int(game.food.pos.x < game.snake.head.x),  # food left
-        int(game.food.pos.y < game.snake.head.y)  # food up
-    ]
-    state = danger + direction + food
-    log_state(state)
+def get_state(game) -> int:
+    # The 11 binary features packed in a single integer, feature i is bit i (see encoding.py):
+    # danger straight, right, left - direction right, down, left, up - food right, down, left, up
+    snake = game.snake
+    direction = snake.direction
+    x, y = snake.head_x, snake.head_y
+    food = game.food
+    state = DIRECTION_BITS[direction]
+    for i, a in enumerate(Action):
+        if game.is_collision(parse_action(a, direction)):
+            state |= 1 << i
+    state |= (food.x > x) << 7 | (food.y > y) << 8 | (food.x < x) << 9 | (food.y < y) << 10
+    if logger_helper.tracing(logger):
+        log_state(state)
     return state
 
 
+def state_extractor(features: str | None = None):
+    # Function returning the state of a game with the given feature set (see features.py), agent.FEATURES by default.
+    # The defaults are read at call time so that the settings changed after import (see sweep.py) are followed
+    if features is None:
+        features = agent.FEATURES
+    if features == "binary":
+        return get_state
+    if features == "rich":
+        rich_features = RichFeatures()
+        return lambda game: rich_features(game, get_state(game))
+    raise ValueError(f"Unknown feature set {features}.")
+
+
 def log_state(state):
+    state = [(state >> i) & 1 for i in range(encoding.STATE_SIZE)]
     danger_message = ""
     direction_message = ""
     food_message = ""
@@ -58,40 +99,121 @@ def log_state(state):
     logger.debug(debug_message)
 
 
-def train():
+def train(cols: int | None = None, rows: int | None = None, headless: bool | None = None,
+          render_every: int | None = None, plotting: bool = True,
+          max_games: int | None = None, target_score: float | None = None, save_model: bool = True,
+          checkpoint_every: int | None = None, resume: bool = False,
+          metrics_filename: str | None = metrics.METRICS_FILENAME, seed: int | None = None,
+          profile: bool | None = None, profile_games: int = 0, record_filename: str | None = None) -> list:
+    # Play on a board of cols x rows cells (gameAI.BOARD_COLS x gameAI.BOARD_ROWS by default) until max_games games
+    # (agent.MAX_GAMES by default) or until the mean score of the last TARGET_WINDOW games reaches target_score, returns
+    # the score of every game.
+    # Every checkpoint_every games the whole training state is saved, resume restarts from the last checkpoint.
+    # Per game metrics are appended to metrics_filename (None = no metrics), plotting opens a viewer on them in another
+    # process. A seed makes the whole training reproducible.
+    # profile times every phase of the loop and logs their histograms every profiler.REPORT_EVERY games, profile_games
+    # writes a cProfile trace of that many games starting from game profiler.PROFILE_START.
+    # Every game is recorded to record_filename if given, to be replayed with trajectory.py
+    # The settings left to None are read from their modules at call time, so that sweep.py can override them
+    if headless is None:
+        headless = gameAI.HEADLESS
+    if render_every is None:
+        render_every = gameAI.RENDER_EVERY
+    if checkpoint_every is None:
+        checkpoint_every = checkpoint.CHECKPOINT_EVERY
+    if profile is None:
+        profile = profiler.PROFILE
+    if max_games is None:
+        max_games = agent.MAX_GAMES
+    if cols is None:
+        cols = gameAI.BOARD_COLS
+    if rows is None:
+        rows = gameAI.BOARD_ROWS
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed)
+        torch.manual_seed(seed)
     scores = []
     mean_scores = []
     total_score = 0
     record = 0
-    game_agent = Agent()
-    game = GameAI()
-    while game_agent.n_games <= agent.MAX_GAMES:
+    game_agent = Agent(seed=seed)
+    game = GameAI(cols, rows, headless=headless, render_every=render_every)
+    extract_state = state_extractor()
+    checkpoints = CheckpointManager() if save_model or checkpoint_every > 0 or resume else None
+    if resume:
+        state = checkpoints.load()
+        if state is None:
+            logger.warning("No checkpoint found, starting a new training.")
+        else:
+            game_agent.load_state_dict(state["agent"])
+            game.load_state_dict(state["game"])
+            scores = state["scores"]
+            mean_scores = state["mean_scores"]
+            total_score = sum(scores)
+            record = max(scores, default=0)
+            checkpoint.set_rng_state(state["rng"])
+            logger.info(f"Resuming training from game {game_agent.n_games}.")
+    metrics_writer = None
+    if metrics_filename is not None:
+        metrics_writer = MetricsWriter(metrics_filename, resume_games=game_agent.n_games if resume else None)
+    if plotting and metrics_writer is not None:
+        subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "plot.py"),
+                          metrics_filename])
+    recorder = None
+    if record_filename is not None:
+        recorder = TrajectoryWriter(record_filename, game.cols, game.rows)
+    timer = profiler.timer
+    timer.enable(profile)
+    window_profiler = GameWindowProfiler(profile_games) if profile_games > 0 else None
+    if window_profiler is not None:
+        window_profiler.game_started(game_agent.n_games)
+    # Per game statistics
+    game_start = time.perf_counter()
+    loss_sum = 0
+    game_updates = game_agent.trainer.n_updates
+    while game_agent.n_games <= max_games:
         speed = agent.SPEED_INITIAL if game_agent.n_games <= agent.MAX_EXPLORATION else agent.SPEED_FINAL
         # get old state
-        state_old = get_state(game)
+        state_old = extract_state(game)
+        timer.lap("state")
 
         # get move
         action = game_agent.get_action(state_old)
+        timer.lap("inference")
+        if recorder is not None:
+            recorder.append(action)
 
-        # perform move and get new state
+        # perform move and get new state (the phases of next_tick are timed by the game)
         reward, score, game_over = game.next_tick(action, speed)
-        state_new = get_state(game)
-
-        # train short memory
-        game_agent.train_short_memory(state_old, action.value, reward, state_new, game_over)
+        state_new = extract_state(game)
+        timer.lap("state")
 
         # remember
         game_agent.remember(state_old, action.value, reward, state_new, game_over)
+        timer.lap("remember")
+
+        # train short memory and mini-batches, following the training schedule of agent.py
+        loss_sum += game_agent.train_on_step(state_old, action.value, reward, state_new, game_over)
+        timer.lap("train_step")
 
         if game_over:
             # train long memory
+            steps = game.tick
+            if recorder is not None:
+                recorder.end_game(game_agent.n_games + 1, game.seed, score)
             game.reset()
             game_agent.n_games += 1
-            game_agent.train_long_memory()
+            timer.lap("reset")
+            if agent.TRAIN_LONG_MEMORY and game_agent.warmed_up():
+                loss_sum += game_agent.train_long_memory()
+            timer.lap("train_long")
 
             if score > record:
                 record = score
-                game_agent.model.save()
+                if save_model:
+                    checkpoints.save_model(game_agent.model)
+            timer.lap("save")
             log_message = f"Game number: {game_agent.n_games}\t\tScore: {score}\tCurrent record: {record}."
             print(log_message)
             logger.info(log_message)
@@ -100,8 +222,71 @@ def train():
             total_score += score
             mean_score = total_score / game_agent.n_games
             mean_scores.append(mean_score)
-            plot(scores, mean_scores)
+            duration = time.perf_counter() - game_start
+            if metrics_writer is not None:
+                metrics_writer.append(game=game_agent.n_games, score=score, mean_score=mean_score, record=record,
+                                      steps=steps, duration=duration, steps_per_second=steps / duration,
+                                      loss=loss_sum / max(game_agent.trainer.n_updates - game_updates, 1),
+                                      epsilon=game_agent.exploration_probability(), replay_size=len(game_agent.memory))
+            timer.lap("log")
+            if checkpoint_every > 0 and game_agent.n_games % checkpoint_every == 0:
+                checkpoints.save(game_agent.n_games, {
+                    "agent": game_agent.state_dict(),
+                    "game": game.state_dict(),
+                    "scores": scores.copy(),
+                    "mean_scores": mean_scores.copy(),
+                    "rng": checkpoint.rng_state(),
+                })
+            timer.lap("save")
+            timer.end_game()
+            if profile and game_agent.n_games % profiler.REPORT_EVERY == 0:
+                logger.info(timer.report())
+            if window_profiler is not None:
+                window_profiler.game_started(game_agent.n_games)
+            if target_score is not None and len(scores) >= TARGET_WINDOW and \
+                    sum(scores[-TARGET_WINDOW:]) / TARGET_WINDOW >= target_score:
+                break
+            game_start = time.perf_counter()
+            loss_sum = 0
+            game_updates = game_agent.trainer.n_updates
+    if window_profiler is not None:
+        window_profiler.stop()
+    if recorder is not None:
+        recorder.close()
+    if profile:
+        report = timer.report()
+        print(report)
+        logger.info(report)
+        timer.enable(False)
+    if metrics_writer is not None:
+        metrics_writer.close()
+    if checkpoints is not None:
+        checkpoints.close()
+    return scores
 
 
 if __name__ == "__main__":
-    train()
+    parser = argparse.ArgumentParser(description="Train the snake agent.")
+    parser.add_argument("--cols", type=int, default=gameAI.BOARD_COLS, help="board width in cells, walls included")
+    parser.add_argument("--rows", type=int, default=gameAI.BOARD_ROWS, help="board height in cells, walls included")
+    parser.add_argument("--headless", action="store_true", default=gameAI.HEADLESS,
+                        help="run without a game window, at full CPU speed")
+    parser.add_argument("--render-every", type=int, default=gameAI.RENDER_EVERY,
+                        help="draw only one game every N games (0 = never)")
+    parser.add_argument("--no-plot", action="store_true", help="don't open the live score plot")
+    parser.add_argument("--resume", action="store_true", help="resume the training from the last checkpoint")
+    parser.add_argument("--profile", action="store_true", default=profiler.PROFILE,
+                        help="time every phase of the training loop and report their histograms")
+    parser.add_argument("--profile-games", type=int, default=0,
+                        help=f"write a cProfile trace of N games to {profiler.PROFILE_FILENAME}")
+    parser.add_argument("--record", nargs="?", const=trajectory.TRAJECTORIES_FILENAME, metavar="FILENAME",
+                        help="record every game to replay it later with trajectory.py")
+    parser.add_argument("--actors", type=int, default=0,
+                        help="train with N headless actor processes and a learner process (0 = single process)")
+    args = parser.parse_args()
+    if args.actors > 0:
+        import actor_learner
+        actor_learner.train_parallel(args.actors)
+    else:
+        train(args.cols, args.rows, headless=args.headless, render_every=args.render_every, plotting=not args.no_plot,
+              resume=args.resume, profile=args.profile, profile_games=args.profile_games, record_filename=args.record)
@@ -0,0 +1,232 @@
+"""
+Replay memory of the agent, stored in preallocated arrays
+"""
+
+import numpy as np
+import torch
+from encoding import ALL_STATES
+import logger_helper
+
+# --------------------------------------------------------
+# If not set, follow the default debug configuration
+DEBUG = None
+LOG_FILENAME = None
+DEBUG_FILENAME = None
+# --------------------------------------------------------
+
+# Set up logging
+logger = logger_helper.setup_logger(__name__, LOG_FILENAME, DEBUG, DEBUG_FILENAME)
+
+# Float tensor of every state, indexed by the packed state
+UNPACKED_STATES = torch.from_numpy(ALL_STATES).float()
+
+
+def unpack(packed) -> torch.Tensor:
+    # Packed states (integer or array) to the float tensor the model takes as input
+    if isinstance(packed, np.ndarray):
+        packed = torch.from_numpy(packed.astype(np.int64))
+    return UNPACKED_STATES[packed]
+
+
+class ReplayMemory:
+    def __init__(self, capacity: int, seed: int | None = None, state_size: int | None = None):
+        self.capacity = capacity
+        # One slot per transition. Binary states (state_size None) are stored packed (see encoding.py) and only unpacked
+        # into float tensors when a batch is sampled: 10 bytes per transition. Other states are float vectors of
+        # state_size features (see features.py)
+        if state_size is None:
+            self.states = np.zeros(capacity, dtype=np.uint16)
+            self.next_states = np.zeros(capacity, dtype=np.uint16)
+            self.to_tensor = unpack
+        else:
+            self.states = np.zeros((capacity, state_size), dtype=np.float32)
+            self.next_states = np.zeros((capacity, state_size), dtype=np.float32)
+            self.to_tensor = torch.from_numpy
+        self.actions = np.zeros(capacity, dtype=np.int8)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.game_overs = np.zeros(capacity, dtype=bool)
+        # Slot of the next transition, once the memory is full we overwrite the oldest transition
+        self.position = 0
+        self.size = 0
+        self.rng = np.random.default_rng(seed)
+        logger.info(f"Replay memory of {capacity} transitions, {self.nbytes() / 2 ** 20:.1f} MiB.")
+
+    def __len__(self):
+        return self.size
+
+    def nbytes(self) -> int:
+        return self.states.nbytes + self.actions.nbytes + self.rewards.nbytes + self.next_states.nbytes + \
+            self.game_overs.nbytes
+
+    def push(self, state: int, action: int, reward: float, next_state: int, game_over: bool):
+        i = self.position
+        self.states[i] = state
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.next_states[i] = next_state
+        self.game_overs[i] = game_over
+        self.position = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def push_many(self, states, actions, rewards, next_states, game_overs):
+        # Add a whole batch of transitions at once, wrapping around the end of the arrays
+        indexes = (self.position + np.arange(len(actions))) % self.capacity
+        self.states[indexes] = states
+        self.actions[indexes] = actions
+        self.rewards[indexes] = rewards
+        self.next_states[indexes] = next_states
+        self.game_overs[indexes] = game_overs
+        self.position = (self.position + len(actions)) % self.capacity
+        self.size = min(self.size + len(actions), self.capacity)
+        return indexes
+
+    def state_dict(self) -> dict:
+        # Copy of the stored transitions, safe to write from another thread while training goes on
+        return {
+            "states": self.states[:self.size].copy(),
+            "actions": self.actions[:self.size].copy(),
+            "rewards": self.rewards[:self.size].copy(),
+            "next_states": self.next_states[:self.size].copy(),
+            "game_overs": self.game_overs[:self.size].copy(),
+            "position": self.position,
+            "rng": self.rng.bit_generator.state,
+        }
+
+    def load_state_dict(self, state: dict):
+        size = len(state["actions"])
+        if size > self.capacity:
+            raise ValueError(f"Can't load {size} transitions in a memory of capacity {self.capacity}.")
+        self.states[:size] = state["states"]
+        self.actions[:size] = state["actions"]
+        self.rewards[:size] = state["rewards"]
+        self.next_states[:size] = state["next_states"]
+        self.game_overs[:size] = state["game_overs"]
+        self.size = size
+        self.position = state["position"] % self.capacity
+        self.rng.bit_generator.state = state["rng"]
+
+    def sample(self, batch_size: int) -> tuple:
+        # If we have more than batch_size transitions we draw a uniform sample (with replacement),
+        # otherwise we take everything we have
+        if self.size > batch_size:
+            indexes = self.rng.integers(0, self.size, batch_size)
+        else:
+            indexes = np.arange(self.size)
+        return self.get(indexes)
+
+    def get(self, indexes) -> tuple:
+        # Transitions at the given slots as tensors ready for QTrainer.train_step, packed states are unpacked in a
+        # single vectorized lookup
+        return (self.to_tensor(self.states[indexes]),
+                torch.from_numpy(self.actions[indexes]).long(),
+                torch.from_numpy(self.rewards[indexes]),
+                self.to_tensor(self.next_states[indexes]),
+                torch.from_numpy(self.game_overs[indexes]))
+
+
+class SumTree:
+    def __init__(self, capacity: int):
+        # Leaves are padded to a power of two so that every leaf is at the same depth.
+        # Node i has children 2i+1 and 2i+2, leaf j is node n_leaves - 1 + j
+        self.n_leaves = 1 << max(0, (capacity - 1).bit_length())
+        self.depth = self.n_leaves.bit_length() - 1
+        self.nodes = np.zeros(2 * self.n_leaves - 1, dtype=np.float64)
+
+    def total(self) -> float:
+        return self.nodes[0]
+
+    def get(self, leaves) -> np.ndarray:
+        return self.nodes[np.asarray(leaves) + self.n_leaves - 1]
+
+    def set(self, leaf: int, priority: float):
+        # Set a single leaf and recompute its ancestors, O(log n)
+        nodes = self.nodes
+        node = leaf + self.n_leaves - 1
+        nodes[node] = priority
+        while node:
+            node = (node - 1) // 2
+            nodes[node] = nodes[2 * node + 1] + nodes[2 * node + 2]
+
+    def update(self, leaves, priorities):
+        # Set many leaves at once and recompute their ancestors one level at a time, O(k log n)
+        nodes = np.asarray(leaves) + self.n_leaves - 1
+        self.nodes[nodes] = priorities
+        for _ in range(self.depth):
+            nodes = (nodes - 1) // 2
+            self.nodes[nodes] = self.nodes[2 * nodes + 1] + self.nodes[2 * nodes + 2]
+
+    def find(self, values) -> np.ndarray:
+        # For every value in [0, total) walk down to the leaf whose cumulative priority range contains it, O(k log n)
+        values = np.array(values, dtype=np.float64)
+        nodes = np.zeros(len(values), dtype=np.int64)
+        for _ in range(self.depth):
+            left = 2 * nodes + 1
+            left_sum = self.nodes[left]
+            go_right = values >= left_sum
+            values = np.where(go_right, values - left_sum, values)
+            nodes = np.where(go_right, left + 1, left)
+        return nodes - (self.n_leaves - 1)
+
+
+class PrioritizedReplayMemory(ReplayMemory):
+    def __init__(self, capacity: int, alpha: float, beta: float, beta_increment: float, epsilon: float,
+                 seed: int | None = None, state_size: int | None = None):
+        # How much prioritization is used, 0 is uniform sampling
+        self.alpha = alpha
+        # Importance sampling correction, annealed to 1 (full correction) by beta_increment every sample
+        self.beta = beta
+        self.beta_increment = beta_increment
+        # Keeps the priority of transitions with zero TD error above zero
+        self.epsilon = epsilon
+        self.tree = SumTree(capacity)
+        # New transitions get the highest priority seen so far, so they are replayed at least once
+        self.max_priority = 1.0
+        # Last, the base constructor logs the size of the whole memory tree included
+        super().__init__(capacity, seed, state_size)
+
+    def nbytes(self) -> int:
+        return super().nbytes() + self.tree.nodes.nbytes
+
+    def push(self, state: int, action: int, reward: float, next_state: int, game_over: bool):
+        self.tree.set(self.position, self.max_priority)
+        super().push(state, action, reward, next_state, game_over)
+
+    def push_many(self, states, actions, rewards, next_states, game_overs):
+        indexes = super().push_many(states, actions, rewards, next_states, game_overs)
+        self.tree.update(indexes, np.full(len(indexes), self.max_priority))
+        return indexes
+
+    def state_dict(self) -> dict:
+        state = super().state_dict()
+        state["priorities"] = self.tree.get(np.arange(self.size))
+        state["beta"] = self.beta
+        state["max_priority"] = self.max_priority
+        return state
+
+    def load_state_dict(self, state: dict):
+        super().load_state_dict(state)
+        # A memory saved without priorities (uniform replay) starts with every transition at the same priority
+        priorities = state.get("priorities", np.ones(self.size))
+        self.tree.update(np.arange(self.size), priorities)
+        self.beta = state.get("beta", self.beta)
+        self.max_priority = state.get("max_priority", self.max_priority)
+
+    def sample(self, batch_size: int) -> tuple:
+        # Returns the transitions, their slots (to update the priorities later) and their importance sampling weights
+        if self.size > batch_size:
+            # Stratified sampling: one draw in each of batch_size equal segments of the total priority
+            segment = self.tree.total() / batch_size
+            values = (np.arange(batch_size) + self.rng.random(batch_size)) * segment
+            indexes = np.minimum(self.tree.find(values), self.size - 1)
+        else:
+            indexes = np.arange(self.size)
+        probabilities = self.tree.get(indexes) / self.tree.total()
+        weights = (self.size * probabilities) ** -self.beta
+        weights /= weights.max()
+        self.beta = min(1.0, self.beta + self.beta_increment)
+        return *self.get(indexes), indexes, torch.from_numpy(weights.astype(np.float32))
+
+    def update_priorities(self, indexes, td_errors):
+        priorities = (np.abs(np.asarray(td_errors, dtype=np.float64)) + self.epsilon) ** self.alpha
+        self.tree.update(indexes, priorities)
+        self.max_priority = max(self.max_priority, priorities.max())
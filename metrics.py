@@ -0,0 +1,147 @@
+"""
+Append-only log of per game training metrics, written by the trainer and read by the viewer in plot.py and for analysis
+"""
+
+import argparse
+import json
+import os
+import time
+import numpy as np
+
+# --------------------------------------------------------
+METRICS_FILENAME = "metrics.bin"
+# Records are buffered in memory and written every FLUSH_EVERY games or FLUSH_SECONDS seconds, whichever comes first
+FLUSH_EVERY = 100
+FLUSH_SECONDS = 1
+# Number of most recent games averaged in the summary of a run
+SUMMARY_WINDOW = 100
+
+# --------------------------------------------------------
+
+# One fixed size record per game
+METRICS_DTYPE = np.dtype([
+    ("game", "<u4"),
+    ("score", "<u4"),
+    ("mean_score", "<f4"),
+    ("record", "<u4"),
+    ("steps", "<u4"),
+    # Wall time of the game in seconds, training included
+    ("duration", "<f4"),
+    ("steps_per_second", "<f4"),
+    # Mean loss of the train_step calls made during the game
+    ("loss", "<f4"),
+    # Probability of a random action during the game
+    ("epsilon", "<f4"),
+    ("replay_size", "<u4"),
+])
+# The file starts with this line followed by a line with the JSON description of the records
+MAGIC = b"SNAKEAI-METRICS\n"
+
+
+def header() -> bytes:
+    return MAGIC + json.dumps(METRICS_DTYPE.descr).encode() + b"\n"
+
+
+def read_header(file) -> np.dtype:
+    if file.readline() != MAGIC:
+        raise ValueError(f"{file.name} is not a metrics file.")
+    return np.dtype([tuple(field) for field in json.loads(file.readline())])
+
+
+def read_metrics(filename: str = METRICS_FILENAME) -> np.ndarray:
+    # Every record of a run as a structured array, e.g. read_metrics()["score"]
+    with open(filename, "rb") as file:
+        dtype = read_header(file)
+        data = file.read()
+    # A record still being written is left out
+    return np.frombuffer(data, dtype=dtype, count=len(data) // dtype.itemsize)
+
+
+def summary(records: np.ndarray) -> dict:
+    recent = records[-SUMMARY_WINDOW:]
+    return {
+        "games": len(records),
+        "record": int(records["record"].max(initial=0)),
+        "mean_score": float(records["score"].mean()) if len(records) else 0.0,
+        "recent_mean_score": float(recent["score"].mean()) if len(recent) else 0.0,
+        "mean_steps": float(records["steps"].mean()) if len(records) else 0.0,
+        "steps_per_second": float(records["steps"].sum() / records["duration"].sum()) if len(records) else 0.0,
+        "hours": float(records["duration"].sum() / 3600),
+    }
+
+
+class MetricsWriter:
+    def __init__(self, filename: str = METRICS_FILENAME, resume_games: int | None = None):
+        # A resumed training keeps the games of the previous run up to the checkpoint it resumed from
+        previous = None
+        if resume_games is not None and os.path.exists(filename):
+            previous = read_metrics(filename)
+            previous = previous[previous["game"] <= resume_games]
+        self.filename = filename
+        self.file = open(filename, "wb")
+        self.file.write(header())
+        if previous is not None:
+            self.file.write(previous.tobytes())
+        self.file.flush()
+        self.buffer = np.zeros(FLUSH_EVERY, dtype=METRICS_DTYPE)
+        self.buffered = 0
+        self.last_flush = time.perf_counter()
+
+    def append(self, **fields):
+        # fields are the columns of METRICS_DTYPE, missing ones are written as 0
+        self.buffer[self.buffered] = tuple(fields.get(name, 0) for name in METRICS_DTYPE.names)
+        self.buffered += 1
+        if self.buffered == FLUSH_EVERY or time.perf_counter() - self.last_flush >= FLUSH_SECONDS:
+            self.flush()
+
+    def flush(self):
+        self.file.write(self.buffer[:self.buffered].tobytes())
+        self.file.flush()
+        self.buffered = 0
+        self.last_flush = time.perf_counter()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class MetricsTail:
+    def __init__(self, filename: str = METRICS_FILENAME):
+        self.filename = filename
+        self.file = None
+        self.dtype = None
+        # Bytes of a record not completely written yet
+        self.partial = b""
+        # Set by the read that found the file truncated (rewritten by a resumed training), whose records start over
+        self.truncated = False
+
+    def read(self) -> np.ndarray:
+        # Records appended since the last call
+        self.truncated = False
+        if self.file is not None and os.fstat(self.file.fileno()).st_size < self.file.tell():
+            self.close()
+            self.file = None
+            self.partial = b""
+            self.truncated = True
+        if self.file is None:
+            if not os.path.exists(self.filename):
+                return np.zeros(0, dtype=METRICS_DTYPE)
+            self.file = open(self.filename, "rb")
+            self.dtype = read_header(self.file)
+        data = self.partial + self.file.read()
+        complete = len(data) - len(data) % self.dtype.itemsize
+        self.partial = data[complete:]
+        return np.frombuffer(data[:complete], dtype=self.dtype)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summary of one or more training runs.")
+    parser.add_argument("filenames", nargs="*", default=[METRICS_FILENAME], help="metrics files")
+    args = parser.parse_args()
+    for filename in args.filenames:
+        values = ", ".join(f"{key}: {value:.6g}" for key, value in summary(read_metrics(filename)).items())
+        print(f"{filename} - {values}")
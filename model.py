@@ -1,3 +1,4 @@
+import copy
 import torch
 import torch.nn as nn
 import torch.optim as optim
@@ -15,6 +16,17 @@ DEBUG_FILENAME = None
 # Set up logging
 logger = logger_helper.setup_logger(__name__, LOG_FILENAME, DEBUG, DEBUG_FILENAME)
 
+MODEL_FOLDER_PATH = "./model"
+
+
+def save_state_dict(state_dict: dict, filename: str = "model.pth"):
+    if not os.path.exists(MODEL_FOLDER_PATH):
+        os.makedirs(MODEL_FOLDER_PATH)
+        logger.info(f"Folder not found, created one at path {MODEL_FOLDER_PATH}.")
+    file_name = os.path.join(MODEL_FOLDER_PATH, filename)
+    torch.save(state_dict, file_name)
+    logger.info(f"Created save file named {filename}.")
+
 
 class Linear_QNet(nn.Module):
     def __init__(self, input_size: int, hidden_size: int, output_size: int):
@@ -33,17 +45,12 @@ class Linear_QNet(nn.Module):
         return x
 
     def save(self, filename: str = "model.pth"):
-        model_folder_path = "./model"
-        if not os.path.exists(model_folder_path):
-            os.makedirs(model_folder_path)
-            logger.info(f"Folder not found, created one at path {model_folder_path}.")
-        file_name = os.path.join(model_folder_path, filename)
-        torch.save(self.state_dict(), file_name)
-        logger.info(f"Created save file named {filename}.")
+        save_state_dict(self.state_dict(), filename)
 
 
 class QTrainer:
-    def __init__(self, model, lr, gamma):
+    def __init__(self, model, lr, gamma, target_network: str = "none", sync_every: int = 100, tau: float = 0.005,
+                 double: bool = False):
         self.lr = lr
         self.gamma = gamma
         self.model = model
@@ -51,50 +58,83 @@ class QTrainer:
         self.optimizer = optim.Adam(model.parameters(), lr=self.lr)
         # We choose a simple mean squared loss function
         self.criterion = nn.MSELoss()
-
-    def train_step(self, state, action_value, reward, next_state, game_over):
-        state = torch.tensor(state, dtype=torch.float)
-        action_value = torch.tensor(action_value, dtype=torch.float)
-        reward = torch.tensor(reward, dtype=torch.float)
-        next_state = torch.tensor(next_state, dtype=torch.float)
+        # Number of optimizer steps made so far
+        self.n_updates = 0
+        # Network computing the bootstrap targets: the model itself ("none"), or a frozen copy of it updated every
+        # sync_every optimizer steps ("hard") or moved towards it by tau after every step ("polyak")
+        if target_network not in ("none", "hard", "polyak"):
+            raise ValueError(f"Unknown target network {target_network}.")
+        self.target_network = target_network
+        self.sync_every = sync_every
+        self.tau = tau
+        if target_network == "none":
+            self.target_model = model
+        else:
+            self.target_model = copy.deepcopy(model)
+            self.target_model.requires_grad_(False)
+        # Double DQN: the next action is chosen by the model and evaluated by the target network
+        self.double = double
+
+    def update_target(self):
+        if self.target_network == "hard" and self.n_updates % self.sync_every == 0:
+            self.target_model.load_state_dict(self.model.state_dict())
+        elif self.target_network == "polyak":
+            with torch.no_grad():
+                for target, parameter in zip(self.target_model.parameters(), self.model.parameters()):
+                    target.lerp_(parameter, self.tau)
+
+    def train_step(self, state, action, reward, next_state, game_over, weights=None) -> (float, torch.Tensor):
+        # action is the index of the action taken, in the order STRAIGHT -> RIGHT -> LEFT.
+        # weights are optional per sample importance sampling weights (prioritized replay).
+        # Returns the loss and the TD error of every sample
+        state = torch.as_tensor(state, dtype=torch.float)
+        action = torch.as_tensor(action, dtype=torch.long)
+        reward = torch.as_tensor(reward, dtype=torch.float)
+        next_state = torch.as_tensor(next_state, dtype=torch.float)
+        game_over = torch.as_tensor(game_over, dtype=torch.bool)
 
         # If we have a single datapoint all the tensors are in the form [...]. We want to reshape them in the form
         # [[...]] for future processing
         if len(state.shape) == 1:
             state = torch.unsqueeze(state, 0)
-            action_value = torch.unsqueeze(action_value, 0)
+            action = torch.unsqueeze(action, 0)
             reward = torch.unsqueeze(reward, 0)
             next_state = torch.unsqueeze(next_state, 0)
-            # Create a tuple with a single element
-            game_over = (game_over,)
-
-        # This is the number of games played we need to analyze
-        n_iterations = len(game_over)
+            game_over = torch.unsqueeze(game_over, 0)
 
         # Implementing Bellman Equation
 
         # Phase 1
-        # Get prediction based on current state and initialize target to its copy
-
+        # Get prediction based on current state
         prediction = self.model(state)
-        target = prediction.clone()
 
         # Phase 2
-        # Calculate Q value
-        # for every iteration we update the new target
-        for i in range(n_iterations):
-            # We add the reward to our Q
-            # If the game is over, no new steps can be taken, we're done
-            Q = reward[i]
-            # If the game's not over, we also add the value of our future action discounted by gamma
-            if not game_over[i]:
-                Q += self.gamma * torch.max(self.model(next_state[i]))
-
-            # Of the three values in the target for our current iteration, we only update the one corresponding to
-            # the action actually taken.
-            target[i][torch.argmax(action_value).item()] = Q
+        # Calculate Q value for the whole batch with a single forward pass of the target network on the next states.
+        # We add the reward to our Q, if the game's not over we also add the value of our future action discounted
+        # by gamma (if the game is over, no new steps can be taken, we're done)
+        with torch.no_grad():
+            rows = torch.arange(len(action))
+            # Without a target network, Double DQN targets are the same as the usual ones
+            if self.double and self.target_model is not self.model:
+                next_action = torch.argmax(self.model(next_state), dim=1)
+                next_q = self.target_model(next_state)[rows, next_action]
+            else:
+                next_q = torch.max(self.target_model(next_state), dim=1).values
+            Q = reward + self.gamma * next_q * ~game_over
+            # Of the three values in the target of every row, we only update the one corresponding to the action
+            # actually taken
+            target = prediction.detach().clone()
+            target[rows, action] = Q
+            td_error = Q - prediction[rows, action]
+
         # calculate the loss with the new computed Q value
         self.optimizer.zero_grad()
-        loss = self.criterion(target, prediction)
+        if weights is None:
+            loss = self.criterion(prediction, target)
+        else:
+            loss = torch.mean(torch.as_tensor(weights, dtype=torch.float)[:, None] * (prediction - target) ** 2)
         loss.backward()
         self.optimizer.step()
+        self.n_updates += 1
+        self.update_target()
+        return loss.item(), td_error
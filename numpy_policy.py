@@ -0,0 +1,42 @@
+"""
+Torch free greedy policy: forward pass of a Linear_QNet exported by export.py, with NumPy only
+"""
+
+import numpy as np
+from encoding import ALL_STATES
+
+
+class NumpyQNet:
+    # Weights of a Linear_QNet as float32 arrays, transposed so that a batch of states multiplies them from the left
+    def __init__(self, weights):
+        self.w1 = np.ascontiguousarray(weights["layer1.weight"].T, dtype=np.float32)
+        self.b1 = np.asarray(weights["layer1.bias"], dtype=np.float32)
+        self.w2 = np.ascontiguousarray(weights["layer2.weight"].T, dtype=np.float32)
+        self.b2 = np.asarray(weights["layer2.bias"], dtype=np.float32)
+        # Feature set of the states, see features.FEATURE_SIZES
+        self.features = str(weights["features"]) if "features" in weights else "binary"
+        # With the binary features the whole greedy policy fits in a table of 2048 actions
+        self.table = np.argmax(self(ALL_STATES), axis=1) if self.features == "binary" else None
+
+    def __call__(self, states) -> np.ndarray:
+        # Q values of a batch of states given as an (N, features) array. A single state is a batch of shape
+        # (1, features), like for the exported torch modules
+        states = np.asarray(states, dtype=np.float32)
+        if states.ndim != 2:
+            raise ValueError(f"Expected a batch of states of shape (N, features), got shape {states.shape}.")
+        hidden = states @ self.w1
+        hidden += self.b1
+        np.maximum(hidden, 0, out=hidden)
+        return hidden @ self.w2 + self.b2
+
+    def act(self, states) -> np.ndarray:
+        # Index of the greedy action of every state of a batch, as returned by the state extraction of main.py: N packed
+        # integers for the binary features, (N, features) vectors otherwise
+        if self.table is not None:
+            return self.table[np.asarray(states)]
+        return np.argmax(self(states), axis=1)
+
+
+def load(filename: str) -> NumpyQNet:
+    with np.load(filename, allow_pickle=False) as weights:
+        return NumpyQNet(weights)
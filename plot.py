@@ -1,6 +1,7 @@
+import argparse
+import math
 import matplotlib.pyplot as plt
-from IPython import display
-from IPython.utils import io
+from metrics import MetricsTail, METRICS_FILENAME
 import logger_helper
 
 # --------------------------------------------------------
@@ -8,28 +9,71 @@ import logger_helper
 DEBUG = None
 LOG_FILENAME = None
 DEBUG_FILENAME = None
+
+# Seconds between two redraws of the viewer
+REFRESH_SECONDS = 1
+# Long histories are downsampled to at most this many points per line
+MAX_POINTS = 2_000
 # --------------------------------------------------------
 
 # Set up logging
 logger = logger_helper.setup_logger(__name__, LOG_FILENAME, DEBUG, DEBUG_FILENAME)
 
-#Activate interactive mode
-plt.ion()
-
-
-def plot(scores, mean_scores):
-    # We need to suppress the output of the IPython module to prevent annoying console messages
-    with io.capture_output() as captured:
-        display.clear_output(wait=True)
-        display.display(plt.gcf())
-        plt.clf()
-        plt.title("Training...")
-        plt.xlabel("Games played")
-        plt.ylabel("Score")
-        plt.plot(scores)
-        plt.plot(mean_scores)
-        plt.ylim(ymin=0)
-        plt.text(len(scores) - 1, scores[-1], str(scores[-1]))
-        plt.text(len(mean_scores) - 1, mean_scores[-1], str(mean_scores[-1]))
+
+def downsample(values: list, max_points: int = MAX_POINTS) -> (range, list):
+    # Keep one point every stride points, always including the last one
+    stride = max(1, math.ceil(len(values) / max_points))
+    x = range(len(values) - 1, -1, -stride)[::-1]
+    return x, [values[i] for i in x]
+
+
+class Viewer:
+    def __init__(self, filename: str = METRICS_FILENAME):
+        self.metrics = MetricsTail(filename)
+        self.scores = []
+        self.mean_scores = []
+        # The figure is created once, every refresh only updates the data of the lines
+        self.figure, self.axes = plt.subplots()
+        self.axes.set_title("Training...")
+        self.axes.set_xlabel("Games played")
+        self.axes.set_ylabel("Score")
+        self.score_line, = self.axes.plot([], [])
+        self.mean_score_line, = self.axes.plot([], [])
+        self.score_text = self.axes.text(0, 0, "")
+        self.mean_score_text = self.axes.text(0, 0, "")
+
+    def refresh(self):
+        records = self.metrics.read()
+        if self.metrics.truncated:
+            self.scores.clear()
+            self.mean_scores.clear()
+        if not len(records):
+            return
+        self.scores.extend(records["score"].tolist())
+        self.mean_scores.extend(records["mean_score"].tolist())
+        self.score_line.set_data(*downsample(self.scores))
+        self.mean_score_line.set_data(*downsample(self.mean_scores))
+        last = len(self.scores) - 1
+        self.score_text.set_position((last, self.scores[-1]))
+        self.score_text.set_text(str(self.scores[-1]))
+        self.mean_score_text.set_position((last, self.mean_scores[-1]))
+        self.mean_score_text.set_text(f"{self.mean_scores[-1]:.2f}")
+        self.axes.relim()
+        self.axes.autoscale_view()
+        self.axes.set_ylim(ymin=0)
+        self.figure.canvas.draw_idle()
+
+    def run(self):
+        # Redraw at our own pace until the window is closed
         plt.show(block=False)
-        plt.pause(.1)
+        while plt.fignum_exists(self.figure.number):
+            self.refresh()
+            plt.pause(REFRESH_SECONDS)
+        self.metrics.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Live plot of the training metrics.")
+    parser.add_argument("filename", nargs="?", default=METRICS_FILENAME, help="metrics file written by the trainer")
+    args = parser.parse_args()
+    Viewer(args.filename).run()
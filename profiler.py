@@ -0,0 +1,137 @@
+"""
+Per phase timers of the training loop and cProfile traces of a window of games
+"""
+
+import cProfile
+import math
+import time
+import logger_helper
+
+# --------------------------------------------------------
+# If not set, follow the default debug configuration
+DEBUG = None
+LOG_FILENAME = None
+DEBUG_FILENAME = None
+
+# Time every phase of the training loop (see train() in main.py)
+PROFILE = False
+# The phase timings are logged every REPORT_EVERY games
+REPORT_EVERY = 100
+# The per game time of a phase is counted in one of HISTOGRAM_BINS power of two bins, the first one ends at
+# HISTOGRAM_MIN seconds
+HISTOGRAM_BINS = 32
+HISTOGRAM_MIN = 1e-6
+# File written by the cProfile trace, readable with pstats, snakeviz or py-spy style flame graph converters
+PROFILE_FILENAME = "profile.pstats"
+# First game traced by cProfile, the first games are skipped to leave the warm up out
+PROFILE_START = 10
+
+# --------------------------------------------------------
+
+# Set up logging
+logger = logger_helper.setup_logger(__name__, LOG_FILENAME, DEBUG, DEBUG_FILENAME)
+
+
+class PhaseTimer:
+    # Lap timer: every call to lap(phase) charges the time elapsed since the previous lap to phase. The phases of a tick
+    # are timed one after the other, so a single clock reading is enough for each of them
+    def __init__(self):
+        self.enabled = False
+        self.last = 0.0
+        # Seconds spent in every phase during the current game
+        self.game_times = {}
+        # Per phase histograms of the game times and totals over the whole run
+        self.histograms = {}
+        self.totals = {}
+        self.games = 0
+
+    def enable(self, enabled: bool = True):
+        self.enabled = enabled
+        self.last = time.perf_counter()
+
+    def lap(self, phase: str):
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.game_times[phase] = self.game_times.get(phase, 0.0) + now - self.last
+        self.last = now
+
+    def end_game(self):
+        # Add the times of the game that just ended to the histograms
+        if not self.enabled:
+            return
+        for phase, seconds in self.game_times.items():
+            if phase not in self.histograms:
+                self.histograms[phase] = [0] * HISTOGRAM_BINS
+                self.totals[phase] = 0.0
+            self.histograms[phase][histogram_bin(seconds)] += 1
+            self.totals[phase] += seconds
+        self.game_times = {}
+        self.games += 1
+
+    def summary(self) -> dict:
+        # Per phase total seconds, share of the total time, mean and approximate median and 90th percentile per game
+        total = sum(self.totals.values()) or 1.0
+        return {phase: {
+            "seconds": seconds,
+            "share": seconds / total,
+            "mean": seconds / max(self.games, 1),
+            "p50": histogram_quantile(self.histograms[phase], 0.5),
+            "p90": histogram_quantile(self.histograms[phase], 0.9),
+        } for phase, seconds in sorted(self.totals.items(), key=lambda item: -item[1])}
+
+    def report(self) -> str:
+        lines = [f"Phase timings over {self.games} games (seconds per game):",
+                 f"{'phase':<16}{'share':>8}{'mean':>12}{'p50':>12}{'p90':>12}"]
+        for phase, stats in self.summary().items():
+            lines.append(f"{phase:<16}{stats['share']:>8.1%}{stats['mean']:>12.3g}{stats['p50']:>12.3g}"
+                         f"{stats['p90']:>12.3g}")
+        return "\n".join(lines)
+
+
+def histogram_bin(seconds: float) -> int:
+    # Bin i holds the times between HISTOGRAM_MIN * 2 ** (i - 1) and HISTOGRAM_MIN * 2 ** i
+    if seconds <= HISTOGRAM_MIN:
+        return 0
+    return min(math.ceil(math.log2(seconds / HISTOGRAM_MIN)), HISTOGRAM_BINS - 1)
+
+
+def histogram_quantile(histogram: list, q: float) -> float:
+    # Upper edge of the bin holding the q quantile
+    target = q * sum(histogram)
+    count = 0
+    for i, n in enumerate(histogram):
+        count += n
+        if count >= target:
+            return HISTOGRAM_MIN * 2 ** i
+    return HISTOGRAM_MIN * 2 ** (HISTOGRAM_BINS - 1)
+
+
+class GameWindowProfiler:
+    # cProfile trace of the games from start to start + games - 1, written to filename once the last one ends
+    def __init__(self, games: int, start: int = PROFILE_START, filename: str = PROFILE_FILENAME):
+        self.start = start
+        self.end = start + games
+        self.filename = filename
+        self.profile = cProfile.Profile()
+        self.running = False
+
+    def game_started(self, n_games: int):
+        # n_games is the number of games already played
+        if n_games == self.start and not self.running:
+            self.profile.enable()
+            self.running = True
+        elif n_games == self.end and self.running:
+            self.stop()
+
+    def stop(self):
+        if not self.running:
+            return
+        self.profile.disable()
+        self.running = False
+        self.profile.dump_stats(self.filename)
+        logger.info(f"Profile of games {self.start} to {self.end - 1} written to {self.filename}.")
+
+
+# Timer shared by the training loop and the game
+timer = PhaseTimer()
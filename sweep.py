@@ -0,0 +1,178 @@
+"""
+Hyperparameter sweeps: headless training runs over a grid or a random sample of settings, in parallel processes
+"""
+
+import argparse
+import concurrent.futures
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import sys
+import time
+import torch
+import agent
+import features
+import gameAI
+import main
+import logger_helper
+
+# --------------------------------------------------------
+# If not set, follow the default debug configuration
+DEBUG = None
+LOG_FILENAME = None
+DEBUG_FILENAME = None
+
+# Search space used when no space file is given: every setting maps to the list of its values, or (random search only)
+# to a range {"low": ..., "high": ..., "log": true/false, "int": true/false}
+SEARCH_SPACE = {
+    "LR": [0.0005, 0.001, 0.002],
+    "GAMMA": [0.8, 0.9, 0.95],
+    "HIDDEN_LAYER_SIZE": [128, 256],
+}
+# Games played by every run
+SWEEP_GAMES = 300
+# Torch threads of every run, the pool runs one process per SWEEP_THREADS cores
+SWEEP_THREADS = 1
+SWEEP_FILENAME = "sweep.json"
+
+# --------------------------------------------------------
+
+# Set up logging
+logger = logger_helper.setup_logger(__name__, LOG_FILENAME, DEBUG, DEBUG_FILENAME)
+
+# Modules whose constants can be swept, a setting is either "NAME" (first module that has it) or "module.NAME"
+SETTINGS_MODULES = {"agent": agent, "gameAI": gameAI, "features": features}
+
+
+def grid(space: dict) -> list:
+    # Every combination of the values of the settings
+    for name, values in space.items():
+        if not isinstance(values, list):
+            raise ValueError(f"A grid search needs a list of values for {name}.")
+    return [dict(zip(space, values)) for values in itertools.product(*space.values())]
+
+
+def random_search(space: dict, n_runs: int, seed: int = 0) -> list:
+    # n_runs settings drawn independently: uniformly from a list, or from a (log) uniform range
+    rng = random.Random(seed)
+    runs = []
+    for _ in range(n_runs):
+        settings = {}
+        for name, values in space.items():
+            if isinstance(values, list):
+                settings[name] = rng.choice(values)
+                continue
+            low, high = values["low"], values["high"]
+            if values.get("log", False):
+                value = math.exp(rng.uniform(math.log(low), math.log(high)))
+            else:
+                value = rng.uniform(low, high)
+            settings[name] = round(value) if values.get("int", False) else value
+        runs.append(settings)
+    return runs
+
+
+def apply_settings(settings: dict):
+    # Overwrite the module constants of this process
+    for name, value in settings.items():
+        module_name, _, constant = name.rpartition(".")
+        if module_name:
+            modules = [SETTINGS_MODULES[module_name]] if module_name in SETTINGS_MODULES else []
+        else:
+            modules = [m for m in SETTINGS_MODULES.values() if hasattr(m, constant)]
+        if not modules or not hasattr(modules[0], constant):
+            raise ValueError(f"Unknown setting {name}.")
+        setattr(modules[0], constant, value)
+    # Constants computed from other constants when the modules were imported
+    agent.MAX_EXPLORATION = int(agent.MAX_GAMES * agent.EXPLORING_PERCENTAGE)
+    agent.INPUT_SIZE = features.FEATURE_SIZES[agent.FEATURES]
+
+
+def init_worker(threads: int):
+    # Pin the torch threads so that the runs don't compete for the cores, and silence the per game prints. Every worker
+    # logs to its own files instead of truncating the log of the parent
+    logger_helper.setup_worker_logging()
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(threads)
+    sys.stdout = open(os.devnull, "w")
+
+
+def run(settings: dict, games: int, seed: int) -> dict:
+    # One headless training, in a worker process
+    apply_settings(settings)
+    start = time.perf_counter()
+    scores = main.train(headless=True, plotting=False, max_games=games, save_model=False, checkpoint_every=0,
+                        metrics_filename=None, seed=seed)
+    seconds = time.perf_counter() - start
+    recent = scores[-main.TARGET_WINDOW:]
+    return {
+        "settings": settings,
+        "seed": seed,
+        "games": len(scores),
+        "seconds": seconds,
+        "mean_score": sum(scores) / max(len(scores), 1),
+        "recent_mean_score": sum(recent) / max(len(recent), 1),
+        "record": max(scores, default=0),
+        "scores": scores,
+    }
+
+
+def sweep(runs: list, games: int = SWEEP_GAMES, seeds: int = 1, workers: int | None = None,
+          threads: int = SWEEP_THREADS) -> list:
+    # Train every settings of runs with seeds 0 to seeds - 1, returns the results in the order of the runs
+    if workers is None:
+        workers = max(1, (os.cpu_count() or 1) // threads)
+    jobs = [(settings, seed) for settings in runs for seed in range(seeds)]
+    logger.info(f"Sweep of {len(jobs)} runs on {workers} processes with {threads} torch threads each.")
+    results = [None] * len(jobs)
+    with concurrent.futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"),
+                                                initializer=init_worker, initargs=(threads,)) as pool:
+        futures = {pool.submit(run, settings, games, seed): i for i, (settings, seed) in enumerate(jobs)}
+        for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            i = futures[future]
+            results[i] = future.result()
+            print(f"[{done}/{len(jobs)}] {format_settings(results[i]['settings'])} seed {results[i]['seed']}: "
+                  f"recent mean score {results[i]['recent_mean_score']:.2f} in {results[i]['seconds']:.0f}s")
+    return results
+
+
+def format_settings(settings: dict) -> str:
+    return ", ".join(f"{name}={value:.4g}" if isinstance(value, float) else f"{name}={value}"
+                     for name, value in settings.items())
+
+
+def table(results: list) -> str:
+    # One line per run, best recent mean score first
+    lines = [f"{'recent mean':>12}{'mean':>8}{'record':>8}{'games':>7}{'seconds':>9}  settings"]
+    for result in sorted(results, key=lambda r: -r["recent_mean_score"]):
+        lines.append(f"{result['recent_mean_score']:>12.2f}{result['mean_score']:>8.2f}{result['record']:>8}"
+                     f"{result['games']:>7}{result['seconds']:>9.0f}  {format_settings(result['settings'])} "
+                     f"seed={result['seed']}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a hyperparameter sweep.")
+    parser.add_argument("--space", help="JSON file with the search space (default: SEARCH_SPACE)")
+    parser.add_argument("--random", type=int, metavar="N", help="random search of N runs instead of a grid search")
+    parser.add_argument("--games", type=int, default=SWEEP_GAMES, help="games played by every run")
+    parser.add_argument("--seeds", type=int, default=1, help="runs of every settings, with seeds 0 to N - 1")
+    parser.add_argument("--workers", type=int, help="parallel runs (default: cores / threads)")
+    parser.add_argument("--threads", type=int, default=SWEEP_THREADS, help="torch threads of every run")
+    parser.add_argument("--output", default=SWEEP_FILENAME, help="JSON file with the results and score curves")
+    args = parser.parse_args()
+    search_space = SEARCH_SPACE
+    if args.space:
+        with open(args.space) as file:
+            search_space = json.load(file)
+    sweep_runs = random_search(search_space, args.random) if args.random else grid(search_space)
+    # Fail on unknown settings before starting any process
+    for sweep_settings in sweep_runs:
+        apply_settings(sweep_settings)
+    sweep_results = sweep(sweep_runs, args.games, args.seeds, args.workers, args.threads)
+    with open(args.output, "w") as file:
+        json.dump(sweep_results, file)
+    print(table(sweep_results))
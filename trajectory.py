@@ -0,0 +1,203 @@
+"""
+Recording of played games as their seed and packed actions, and deterministic replay of the recorded games
+"""
+
+import argparse
+import json
+import os
+import numpy as np
+import gameAI
+from gameAI import GameAI, Action
+import logger_helper
+
+# --------------------------------------------------------
+# If not set, follow the default debug configuration
+DEBUG = None
+LOG_FILENAME = None
+DEBUG_FILENAME = None
+
+TRAJECTORIES_FILENAME = "trajectories.bin"
+# Games are buffered in memory and written every FLUSH_EVERY games
+FLUSH_EVERY = 100
+# Default speed of the replays, in ticks per second
+REPLAY_SPEED = 20
+
+# --------------------------------------------------------
+
+# Set up logging
+logger = logger_helper.setup_logger(__name__, LOG_FILENAME, DEBUG, DEBUG_FILENAME)
+
+# An action is stored as its index in Action, on 2 bits: a byte holds 4 steps
+ACTIONS = list(Action)
+ACTION_CODES = {a: i for i, a in enumerate(Action)}
+ACTIONS_PER_BYTE = 4
+ACTION_SHIFTS = np.arange(ACTIONS_PER_BYTE, dtype=np.uint8) * 2
+# The actions of every game are appended to the trajectories file, and the index file (same name + ".idx") has one
+# record per game pointing to them
+INDEX_DTYPE = np.dtype([
+    ("game", "<u4"),
+    ("seed", "<u4"),
+    ("steps", "<u4"),
+    ("score", "<u4"),
+    ("offset", "<u8"),
+])
+# The trajectories file starts with this line followed by a line with the JSON description of the board
+MAGIC = b"SNAKEAI-TRAJECTORIES\n"
+
+
+def pack_actions(actions) -> bytes:
+    # Action indexes to bytes, 4 per byte from the lowest bits
+    actions = np.asarray(actions, dtype=np.uint8)
+    padded = np.zeros(-(-len(actions) // ACTIONS_PER_BYTE) * ACTIONS_PER_BYTE, dtype=np.uint8)
+    padded[:len(actions)] = actions
+    return np.bitwise_or.reduce(padded.reshape(-1, ACTIONS_PER_BYTE) << ACTION_SHIFTS, axis=1).tobytes()
+
+
+def unpack_actions(data: bytes, steps: int) -> np.ndarray:
+    packed = np.frombuffer(data, dtype=np.uint8)
+    return ((packed[:, None] >> ACTION_SHIFTS) & 3).reshape(-1)[:steps]
+
+
+class TrajectoryWriter:
+    def __init__(self, filename: str = TRAJECTORIES_FILENAME, cols: int = gameAI.BOARD_COLS,
+                 rows: int = gameAI.BOARD_ROWS):
+        self.filename = filename
+        self.file = open(filename, "wb")
+        self.file.write(MAGIC + json.dumps({"cols": cols, "rows": rows}).encode() + b"\n")
+        self.index_file = open(filename + ".idx", "wb")
+        self.offset = self.file.tell()
+        # Actions of the game being played, then packed games waiting to be written
+        self.actions = []
+        self.games = []
+        self.index = np.zeros(FLUSH_EVERY, dtype=INDEX_DTYPE)
+
+    def append(self, action: Action):
+        self.actions.append(ACTION_CODES[action])
+
+    def end_game(self, game: int, seed: int, score: int):
+        data = pack_actions(self.actions)
+        self.index[len(self.games)] = (game, seed, len(self.actions), score, self.offset)
+        self.games.append(data)
+        self.offset += len(data)
+        self.actions = []
+        if len(self.games) == FLUSH_EVERY:
+            self.flush()
+
+    def flush(self):
+        self.file.write(b"".join(self.games))
+        self.file.flush()
+        # The index is written after the actions it points to
+        self.index_file.write(self.index[:len(self.games)].tobytes())
+        self.index_file.flush()
+        self.games = []
+
+    def close(self):
+        self.flush()
+        self.file.close()
+        self.index_file.close()
+
+
+class TrajectoryReader:
+    def __init__(self, filename: str = TRAJECTORIES_FILENAME):
+        self.filename = filename
+        with open(filename, "rb") as file:
+            if file.readline() != MAGIC:
+                raise ValueError(f"{filename} is not a trajectories file.")
+            self.board = json.loads(file.readline())
+        with open(filename + ".idx", "rb") as file:
+            data = file.read()
+        # A record still being written is left out
+        self.index = np.frombuffer(data, dtype=INDEX_DTYPE, count=len(data) // INDEX_DTYPE.itemsize)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def find(self, game: int) -> int:
+        # Position in the index of the given game number
+        found = np.flatnonzero(self.index["game"] == game)
+        if not len(found):
+            raise KeyError(f"Game {game} is not in {self.filename}.")
+        return int(found[0])
+
+    def actions(self, i: int) -> np.ndarray:
+        record = self.index[i]
+        with open(self.filename, "rb") as file:
+            file.seek(int(record["offset"]))
+            data = file.read(-(-int(record["steps"]) // ACTIONS_PER_BYTE))
+        return unpack_actions(data, int(record["steps"]))
+
+
+def replay(reader: TrajectoryReader, i: int, headless: bool = True, speed: int = REPLAY_SPEED,
+           last_steps: int | None = None):
+    # Play again the i-th recorded game, yielding the game after every drawn tick. With last_steps only the last
+    # last_steps ticks are drawn, the ones before are played without drawing
+    record = reader.index[i]
+    actions = reader.actions(i)
+    game = GameAI(reader.board["cols"], reader.board["rows"], headless=headless, render_every=0,
+                  seed=int(record["seed"]))
+    first_drawn = 0 if last_steps is None else max(len(actions) - last_steps, 0)
+    game.rendering = first_drawn == 0
+    game_over = False
+    for step, action in enumerate(actions):
+        if step == first_drawn:
+            game.rendering = True
+        game_over = game.next_tick(ACTIONS[action], speed)[2]
+        if game.rendering:
+            if game_over:
+                # next_tick doesn't draw the last tick
+                game.update_ui()
+            yield game
+    if game.score != record["score"] or not game_over:
+        logger.warning(f"Replay of game {record['game']} diverged from the recording: score {game.score} instead "
+                       f"of {record['score']}.")
+
+
+def save_frames(reader: TrajectoryReader, i: int, folder: str, last_steps: int | None = None) -> int:
+    # Write every frame of the replay to folder as PNG files, returns the number of frames
+    import pygame
+    os.makedirs(folder, exist_ok=True)
+    n_frames = 0
+    for n_frames, game in enumerate(replay(reader, i, last_steps=last_steps), 1):
+        pygame.image.save(game.screen, os.path.join(folder, f"frame_{n_frames:05d}.png"))
+    return n_frames
+
+
+def save_gif(reader: TrajectoryReader, i: int, filename: str, speed: int = REPLAY_SPEED,
+             last_steps: int | None = None) -> int:
+    # Animated GIF of the replay at speed ticks per second, returns the number of frames
+    import pygame
+    from PIL import Image
+    frames = [Image.frombytes("RGB", game.screen.get_size(), pygame.image.tobytes(game.screen, "RGB"))
+              for game in replay(reader, i, last_steps=last_steps)]
+    if frames:
+        frames[0].save(filename, save_all=True, append_images=frames[1:], duration=1000 / speed, loop=0)
+    return len(frames)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a recorded game.")
+    parser.add_argument("filename", nargs="?", default=TRAJECTORIES_FILENAME, help="trajectories file")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--game", type=int, help="game number to replay (default: the last recorded game)")
+    group.add_argument("--best", action="store_true", help="replay the game with the best score")
+    parser.add_argument("--speed", type=int, default=REPLAY_SPEED, help="ticks per second")
+    parser.add_argument("--last-steps", type=int, help="only show the last N steps before the game over")
+    parser.add_argument("--frames", metavar="FOLDER", help="write the frames as PNG files instead of showing them")
+    parser.add_argument("--gif", metavar="FILENAME", help="write an animated GIF instead of showing the replay")
+    args = parser.parse_args()
+    trajectories = TrajectoryReader(args.filename)
+    if not len(trajectories):
+        parser.error(f"no game recorded in {args.filename}")
+    if args.game is not None:
+        index = trajectories.find(args.game)
+    elif args.best:
+        index = int(np.argmax(trajectories.index["score"]))
+    else:
+        index = len(trajectories) - 1
+    if args.frames:
+        print(f"{save_frames(trajectories, index, args.frames, args.last_steps)} frames written to {args.frames}.")
+    elif args.gif:
+        print(f"{save_gif(trajectories, index, args.gif, args.speed, args.last_steps)} frames written to {args.gif}.")
+    else:
+        for _ in replay(trajectories, index, headless=False, speed=args.speed, last_steps=args.last_steps):
+            pass
@@ -0,0 +1,241 @@
+"""
+Vectorized version of the AI game: N independent boards advanced in lockstep with NumPy arrays
+"""
+
+import random
+import time
+import numpy as np
+import gameAI
+from encoding import STATE_SIZE, pack_states
+from gameAI import Action
+import logger_helper
+
+# --------------------------------------------------------
+# If not set, follow the default debug configuration
+DEBUG = None
+LOG_FILENAME = None
+DEBUG_FILENAME = None
+
+# Number of games simulated in lockstep
+N_GAMES = 1_024
+# Length of the snake at the start of every game
+START_LENGTH = 3
+
+# --------------------------------------------------------
+
+# Absolute directions in clockwise order (RIGHT, DOWN, LEFT, UP), same order as gameAI.clockwise_directions
+DIRECTION_X = np.array([1, 0, -1, 0])
+DIRECTION_Y = np.array([0, 1, 0, -1])
+# Change of the clockwise direction index for every action, in the order STRAIGHT -> RIGHT -> LEFT
+ACTION_TURN = np.array([0, 1, -1])
+# Food cell of a board where the snake covers every cell, never reached by the head
+NO_FOOD = -1
+
+# Set up logging
+logger = logger_helper.setup_logger(__name__, LOG_FILENAME, DEBUG, DEBUG_FILENAME)
+
+
+class VecGameAI:
+    def __init__(self, n_games: int = N_GAMES, cols: int | None = None, rows: int | None = None,
+                 seed: int | None = None, auto_reset: bool = True):
+        self.n_games = n_games
+        # Boards are grids of cells (gameAI.BOARD_COLS x gameAI.BOARD_ROWS by default, read at call time like
+        # GameAI), the outer ring of cells is the wall
+        if cols is None:
+            cols = gameAI.BOARD_COLS
+        if rows is None:
+            rows = gameAI.BOARD_ROWS
+        self.cols = cols
+        self.rows = rows
+        # The longest possible snake covers every cell inside the walls
+        self.capacity = (self.cols - 2) * (self.rows - 2)
+        self.rng = np.random.default_rng(seed)
+        # Reset finished games at the end of next_tick, their last state is kept in final_states
+        self.auto_reset = auto_reset
+        self.games = np.arange(n_games)
+        # Static occupancy of the walls, copied into every board on reset
+        walls = np.zeros((self.rows, self.cols), dtype=np.uint8)
+        walls[0, :] = walls[-1, :] = walls[:, 0] = walls[:, -1] = 1
+        self.walls = walls.ravel()
+        # Occupancy grid of every board: number of walls and snake sections (head included) in each cell
+        self.grid = np.zeros((n_games, self.rows * self.cols), dtype=np.uint8)
+        # Ring buffer with the flat cell index of every snake section, the head is at head_ptr and the tail is
+        # length - 1 slots behind it
+        self.body = np.zeros((n_games, self.capacity), dtype=np.int64)
+        self.head_ptr = np.zeros(n_games, dtype=np.int64)
+        self.head_x = np.zeros(n_games, dtype=np.int64)
+        self.head_y = np.zeros(n_games, dtype=np.int64)
+        # Index in the clockwise order of DIRECTION_X / DIRECTION_Y
+        self.direction = np.zeros(n_games, dtype=np.int64)
+        self.length = np.zeros(n_games, dtype=np.int64)
+        # A section is added on the next movement after eating, like Snake.new_section
+        self.new_section = np.zeros(n_games, dtype=bool)
+        # Flat cell index of the food, NO_FOOD once the snake covers the whole board
+        self.food = np.zeros(n_games, dtype=np.int64)
+        self.score = np.zeros(n_games, dtype=np.int64)
+        self.tick = np.zeros(n_games, dtype=np.int64)
+        # State of the games that ended during the last tick, before they were reset
+        self.final_states = np.zeros(n_games, dtype=np.uint16)
+        self.reset()
+
+    def reset(self, games=None):
+        # Reset every game, or only the selected ones (index array or boolean mask)
+        games = self.games if games is None else np.asarray(games)
+        if games.dtype == bool:
+            games = np.flatnonzero(games)
+        if len(games) == 0:
+            return
+        self.grid[games] = self.walls
+        # Snake starts at length START_LENGTH, at the center of the screen, facing right
+        start_x = self.cols // 2
+        start_y = self.rows // 2
+        # Sections from the tail to the head
+        cells = start_y * self.cols + start_x - np.arange(START_LENGTH - 1, -1, -1)
+        self.body[games, :START_LENGTH] = cells
+        self.grid[games[:, None], cells[None, :]] += 1
+        self.head_ptr[games] = START_LENGTH - 1
+        self.head_x[games] = start_x
+        self.head_y[games] = start_y
+        self.direction[games] = 0
+        self.length[games] = START_LENGTH
+        self.new_section[games] = False
+        self.score[games] = 0
+        self.tick[games] = 0
+        self.place_food(games)
+
+    def place_food(self, games):
+        free = self.grid[games] == 0
+        # Uniform draw among the free cells of every board: the free cell with the largest random key wins
+        keys = self.rng.random(free.shape)
+        keys[~free] = -1
+        food = keys.argmax(axis=1)
+        # A board without any free cell has no food (argmax would pick the wall at cell 0)
+        full = ~free.any(axis=1)
+        if full.any():
+            logger.info(f"The snake covers the whole board in {full.sum()} games, no space left for food.")
+            food[full] = NO_FOOD
+        self.food[games] = food
+
+    def next_tick(self, actions) -> (np.ndarray, np.ndarray, np.ndarray):
+        # actions is an array of N action indexes in the order STRAIGHT -> RIGHT -> LEFT
+        actions = np.asarray(actions)
+        games = self.games
+        self.tick += 1
+        reward = np.zeros(self.n_games, dtype=np.int64)
+        self.direction = (self.direction + ACTION_TURN[actions]) % 4
+        # Move snake
+        self.head_x += DIRECTION_X[self.direction]
+        self.head_y += DIRECTION_Y[self.direction]
+        new_head = self.head_y * self.cols + self.head_x
+        # The tail leaves its cell, unless the snake is growing
+        tail = self.body[games, (self.head_ptr - self.length + 1) % self.capacity]
+        moving = ~self.new_section
+        self.grid[games[moving], tail[moving]] -= 1
+        self.length[self.new_section] += 1
+        self.new_section[:] = False
+        self.head_ptr = (self.head_ptr + 1) % self.capacity
+        self.body[games, self.head_ptr] = new_head
+        # The new head cell collides if it's a wall or still holds a section of the snake
+        collision = self.grid[games, new_head] > 0
+        self.grid[games, new_head] += 1
+        # Check if food eaten
+        eaten = new_head == self.food
+        if eaten.any():
+            reward[eaten] = 10
+            self.score[eaten] += 1
+            self.new_section[eaten] = True
+            self.place_food(np.flatnonzero(eaten))
+        # Check game over
+        game_over = collision | (self.tick > gameAI.STEPS_PER_LENGTH * self.length)
+        reward[game_over] = -10
+        score = self.score.copy()
+        if self.auto_reset and game_over.any():
+            finished = np.flatnonzero(game_over)
+            self.final_states[finished] = self.get_state(finished)
+            self.reset(finished)
+        return reward, score, game_over
+
+    def get_state(self, games=None) -> np.ndarray:
+        # Same packed state as main.get_state for every selected game
+        return pack_states(self.get_features(games))
+
+    def get_features(self, games=None) -> np.ndarray:
+        # The 11 binary features of the state of every selected game, as an (N, 11) array
+        games = self.games if games is None else games
+        head_x = self.head_x[games]
+        head_y = self.head_y[games]
+        direction = self.direction[games]
+        state = np.empty((len(head_x), STATE_SIZE), dtype=np.int8)
+        # Danger straight, right and left
+        for i, turn in enumerate(ACTION_TURN):
+            new_direction = (direction + turn) % 4
+            x = head_x + DIRECTION_X[new_direction]
+            y = head_y + DIRECTION_Y[new_direction]
+            # A finished game can have its head in the wall, so the neighbour may be outside the grid
+            inside = (x >= 0) & (x < self.cols) & (y >= 0) & (y < self.rows)
+            cells = np.where(inside, y * self.cols + x, 0)
+            state[:, i] = ~inside | (self.grid[games, cells] > 0)
+        # Direction
+        state[:, 3:7] = direction[:, None] == np.arange(4)
+        # Food, no food feature is set on a board without food
+        food = self.food[games]
+        has_food = food != NO_FOOD
+        food_x = food % self.cols
+        food_y = food // self.cols
+        state[:, 7] = has_food & (food_x > head_x)
+        state[:, 8] = has_food & (food_y > head_y)
+        state[:, 9] = has_food & (food_x < head_x)
+        state[:, 10] = has_food & (food_y < head_y)
+        return state
+
+
+def check_parity(n_ticks: int = 10_000, seed: int = 0):
+    # Play the same random actions on a GameAI and on a single board VecGameAI, raise RuntimeError if the state, reward,
+    # score or game over flag differ on any tick. Food is copied from GameAI, since the two games draw it differently.
+    from main import get_state
+
+    rng = random.Random(seed)
+    game = gameAI.GameAI(headless=True)
+    vec_game = VecGameAI(1, game.cols, game.rows, seed=seed, auto_reset=False)
+    actions = list(Action)
+
+    def sync_food():
+        vec_game.food[0] = game.food.cell
+
+    sync_food()
+    mismatches = 0
+    for _ in range(n_ticks):
+        option = rng.randrange(len(actions))
+        expected = game.next_tick(actions[option])
+        expected_state = get_state(game)
+        reward, score, game_over = vec_game.next_tick([option])
+        sync_food()
+        state = int(vec_game.get_state()[0])
+        if (int(reward[0]), int(score[0]), bool(game_over[0])) != expected or state != expected_state:
+            mismatches += 1
+            logger.warning(f"Parity mismatch: GameAI {expected} {expected_state}, "
+                           f"VecGameAI {(reward[0], score[0], game_over[0])} {state}.")
+        if expected[2]:
+            game.reset()
+            vec_game.reset()
+            sync_food()
+    if mismatches:
+        raise RuntimeError(f"VecGameAI differs from GameAI on {mismatches} of {n_ticks} ticks.")
+
+
+def steps_per_second(n_games: int = N_GAMES, n_ticks: int = 1_000, seed: int = 0) -> float:
+    # Throughput of random play, counted in single game steps
+    vec_game = VecGameAI(n_games, seed=seed)
+    rng = np.random.default_rng(seed)
+    start = time.perf_counter()
+    for _ in range(n_ticks):
+        vec_game.next_tick(rng.integers(0, 3, n_games))
+        vec_game.get_state()
+    return n_games * n_ticks / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    check_parity()
+    print("Parity check against GameAI: every tick matches.")
+    for n in (1, 64, 1_024, 8_192):
+        print(f"{n} games: {steps_per_second(n, n_ticks=max(10, 100_000 // n)):,.0f} steps/sec.")